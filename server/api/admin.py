@@ -6,6 +6,7 @@ admin.site.register(Player)
 admin.site.register(MissionStunt)
 admin.site.register(Mission)
 admin.site.register(Bounty)
+admin.site.register(CoinTransaction)
 
 class CharactorInline(admin.TabularInline):
     model = Charactor
@@ -0,0 +1,126 @@
+# api.archive
+
+'''
+Archiving finished games.  Once Game.game_over() has run, a game's
+Missions, Submissions, Bounties, Awards, Invites, Notifications and coin
+ledger are only history, but they sit in the same tables as the live games
+and every scan of those tables pays for them.
+
+archive_game() writes one GameArchive per game holding the final
+api.history state and ledger totals.  It then deletes the derived rows
+chunk_size at a time, each chunk in its own transaction, and shrinks the
+Charactors' db_attrs to what still gets shown.  Events, GameSnapshots,
+Charactors and the Game itself stay.
+
+Every step can be run again, so a run that dies part way is finished by
+the next one.  GameArchive.compacted is only set once all of it is done.
+'''
+
+from django.apps import apps
+from django.db import models, transaction
+
+from api import history
+from api import jasoncodec
+
+# Charactor db_attrs keys kept after compaction
+CHARACTOR_KEEPS = ('c_name', 'activity')
+
+
+def derived_rows(game_id):
+    '''
+    (name, queryset) for every table emptied of the game's rows
+    '''
+    get = lambda name: apps.get_model('api', name).objects
+    return [
+        ('notifications', get('Notification').filter(charactor__game=game_id)),
+        ('coin transactions',
+         get('CoinTransaction').filter(charactor__game=game_id)),
+        ('submissions', get('Submission').filter(game=game_id)),
+        ('bounties', get('Bounty').filter(game=game_id)),
+        ('awards', get('Award').filter(game=game_id)),
+        ('missions', get('Mission').filter(game=game_id)),
+        ('invites', get('Invite').filter(game=game_id)),
+    ]
+
+
+def games_to_archive():
+    Game = apps.get_model('api', 'Game')
+    return Game.objects.filter(ix_over=True).exclude(
+        gamearchive__compacted=True).order_by('id')
+
+
+def archive_game(game_id, chunk_size=500):
+    '''
+    Archive and compact one finished game.  Yields (what, count) for every
+    chunk deleted or compacted.
+    '''
+    GameArchive = apps.get_model('api', 'GameArchive')
+    archive = GameArchive.objects.filter(game=game_id).first()
+    if archive is None:
+        archive = write_archive(game_id)
+    if archive.compacted:
+        return
+    for name, rows in derived_rows(game_id):
+        for n in delete_in_chunks(rows, chunk_size):
+            yield name, n
+    for n in compact_charactors(game_id, chunk_size):
+        yield 'charactors compacted', n
+    GameArchive.objects.filter(pk=archive.pk).update(compacted=True)
+
+
+@transaction.atomic
+def write_archive(game_id):
+    GameArchive = apps.get_model('api', 'GameArchive')
+    CoinTransaction = apps.get_model('api', 'CoinTransaction')
+    state = history.state_at(game_id)
+    # {charactor: {reason: total}}
+    ledger = {}
+    totals = CoinTransaction.objects.filter(
+        charactor__game=game_id).values('charactor', 'reason').annotate(
+        total=models.Sum('amount'))
+    for row in totals:
+        ledger.setdefault(str(row['charactor']), {})[row['reason']] = \
+            row['total']
+    summary = dict(state=state, ledger=ledger)
+    return GameArchive.objects.create(
+        game_id=game_id, event_id=state['event'],
+        summary=jasoncodec.get_codec().dumps(summary))
+
+
+def delete_in_chunks(rows, chunk_size):
+    while True:
+        ids = list(rows.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        with transaction.atomic():
+            rows.model.objects.filter(id__in=ids).delete()
+        yield len(ids)
+
+
+def compact_charactors(game_id, chunk_size):
+    '''
+    Drop everything but CHARACTOR_KEEPS from the game's Charactor db_attrs
+    '''
+    Charactor = apps.get_model('api', 'Charactor')
+    codec = jasoncodec.get_codec()
+    rows = Charactor.objects.filter(game=game_id).order_by('id')
+    last = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last).values_list(
+            'id', 'db_attrs')[:chunk_size])
+        if not chunk:
+            return
+        with transaction.atomic():
+            for pk, db_attrs in chunk:
+                try:
+                    jdict = jasoncodec.loads(db_attrs)
+                except ValueError:
+                    continue
+                if set(jdict) <= set(CHARACTOR_KEEPS):
+                    continue
+                kept = dict((k, jdict[k]) for k in CHARACTOR_KEEPS
+                            if k in jdict)
+                Charactor.objects.filter(pk=pk).update(
+                    db_attrs=codec.dumps(kept))
+        last = chunk[-1][0]
+        yield len(chunk)
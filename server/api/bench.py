@@ -0,0 +1,330 @@
+# api.bench
+
+'''
+Microbenchmarks for the LazyJason storage layer.  Run them against the
+configured database with
+
+    python manage.py lazybench            # everything
+    python manage.py lazybench bulk_load  # just one
+
+Every benchmark runs inside a transaction that is rolled back, so nothing
+it creates is left behind, except @committing ones which delete their own
+rows.
+'''
+
+import json
+import time
+from collections import OrderedDict
+
+from django.db import models
+
+from api import instrument
+from api.instrument import trace, TRACE
+from api.lazyjason import LazyJason
+
+BENCHMARKS = OrderedDict()
+
+
+class BenchmarkFailed(Exception):
+    '''
+    Raised by a benchmark whose stress check got the wrong answer
+    '''
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def committing(fn):
+    '''
+    For benchmarks whose data has to be committed, eg. to be seen from
+    other threads.  They don't get rolled back, so they clean up after
+    themselves.
+    '''
+    fn.atomic = False
+    return fn
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(out, label, seconds, count=None):
+    line = '  %-40s %9.2f ms' % (label, seconds * 1000)
+    if count:
+        line += '  (%6.1f us/row)' % (seconds * 1e6 / count)
+    out.write(line + '\n')
+
+
+def big_charactor_attrs(i, notifications=400):
+    return json.dumps(dict(
+        c_name='C-bench-%d' % i,
+        coin=100 + i,
+        activity='hunting',
+        potential_missions=[str(x) for x in range(i, i + 2)],
+        notifications=[
+            dict(kind='bounty_new', submission=str(n), text='x' * 40)
+            for n in range(notifications)
+        ],
+        current_prey_submissions=[str(x) for x in range(20)],
+        current_judge_submissions=[str(x) for x in range(20)],
+    ))
+
+
+@benchmark
+def bulk_load(out, rows=2000):
+    '''
+    Build every Charactor of a big game, then touch only a real column
+    (deferred decode) or a lazy key (what every row used to cost).
+    '''
+    from api.models import Game, Player, Charactor
+
+    g = Game(name='bench bulk_load')
+    g.save()
+    p = Player(unique_name='bench bulk_load')
+    p.save()
+    Charactor.objects.bulk_create([
+        Charactor(game=g, player=p, db_attrs=big_charactor_attrs(i))
+        for i in range(rows)
+    ])
+    out.write('bulk_load: %d Charactors, %d bytes of db_attrs each\n' % (
+        rows, len(big_charactor_attrs(0))))
+
+    def ids_only():
+        [c.id for c in Charactor.objects.filter(game=g)]
+
+    def lazy_key():
+        [c.c_name for c in Charactor.objects.filter(game=g)]
+
+    report(out, 'columns only (decode deferred)', best_of(ids_only), rows)
+    report(out, 'lazy key read (decode every row)', best_of(lazy_key), rows)
+
+
+def submission_attrs(i, ids=300):
+    return dict(
+        mission=str(i),
+        photo_url='http://i.imgur.com/L8GlJ3A.gif',
+        tips={'yes': 15, 'no': 5},
+        judges=[str(i + 1), str(i + 2)],
+        winning_judge=str(i + 1),
+        judgement=True,
+        dismissed=False,
+        eligible_bounties=[str(x) for x in range(i, i + ids)],
+    )
+
+
+@benchmark
+def codecs(out, docs=300):
+    '''
+    Encode/decode throughput and stored size for every jasoncodec codec
+    on Charactor and Submission shaped documents.
+    '''
+    from api import jasoncodec
+
+    samples = [
+        ('Charactor', [json.loads(big_charactor_attrs(i)) for i in range(docs)]),
+        ('Submission', [submission_attrs(i) for i in range(docs)]),
+    ]
+    for label, dicts in samples:
+        out.write('codecs: %d %s documents\n' % (docs, label))
+        for name, codec in sorted(jasoncodec.CODECS.items()):
+            encoded = [codec.dumps(d) for d in dicts]
+            size = sum(len(x) for x in encoded)
+            enc = best_of(lambda: [codec.dumps(d) for d in dicts])
+            dec = best_of(lambda: [jasoncodec.loads(x, codec) for x in encoded])
+            out.write('  %-10s %8d bytes/doc  encode %7.0f docs/s  '
+                      'decode %7.0f docs/s\n' % (
+                name, size / docs, docs / enc, docs / dec))
+
+
+class LegacyAccess(object):
+    '''
+    The attribute path lazy keys took before the schema was compiled into
+    descriptors: a __getattr__ miss for every read and a __setattr__ check
+    for every write, lazy or not.
+    '''
+    _lazy_defaults = dict(c_name='C-?', activity='choosing_mission')
+
+    def __init__(self, jdict):
+        self.__dict__['_jdict'] = jdict
+        self.__dict__['_dirty'] = set()
+
+    def __getattr__(self, attrname):
+        if attrname.startswith('_'):
+            return object.__getattribute__(self, attrname)
+        if attrname in self._jdict:
+            return self._jdict[attrname]
+        return object.__getattribute__(self, attrname)
+
+    def __setattr__(self, attrname, val):
+        d = self.__dict__
+        if '_dirty' in d and (attrname in self._lazy_defaults
+                              or ('_jdict' in d and attrname in d['_jdict'])):
+            if isinstance(val, LazyJason):
+                val = str(val.id)
+            if isinstance(val, list) and val and isinstance(val[0], LazyJason):
+                val = [str(x.id) for x in val]
+            if TRACE >= instrument.level:
+                trace(TRACE, '%s.%s = %r', 'Legacy', attrname, val)
+            return self.lazy_set(**{attrname:val})
+        return super(LegacyAccess, self).__setattr__(attrname, val)
+
+    def lazy_set(self, **kwargs):
+        self._jdict.update(kwargs)
+        self._dirty.update(kwargs)
+        self.__dict__['_stale'] = True
+
+
+@benchmark
+def lazy_attrs(out, loops=100000):
+    '''
+    Reads and writes of lazy keys and of a plain attribute, through the
+    compiled descriptors and through the old __getattr__ / __setattr__.
+    '''
+    from api.models import Charactor
+
+    c = Charactor(db_attrs=big_charactor_attrs(0, notifications=0))
+    legacy = LegacyAccess(json.loads(c.db_attrs))
+    out.write('lazy_attrs: %d accesses each\n' % loops)
+    for label, obj in [('descriptor', c), ('legacy', legacy)]:
+        def read():
+            for _ in xrange(loops):
+                obj.c_name
+        def write():
+            for _ in xrange(loops):
+                obj.c_name = 'C-bench'
+        def plain():
+            for _ in xrange(loops):
+                obj.plain = 5
+        report(out, '%s lazy read' % label, best_of(read), loops)
+        report(out, '%s lazy write' % label, best_of(write), loops)
+        report(out, '%s plain write' % label, best_of(plain), loops)
+
+
+def legacy_bounty_hunters(target):
+    # Bounty.get_bounty_hunters before the index: every Mission of every
+    # game, and two lookups per active one
+    from api.models import Mission
+    bounty_hunters = set()
+    for m in [x for x in Mission.objects.all() if x.active]:
+        if m.prey_Charactor__object == target:
+            bounty_hunters.add(m.hunter_Charactor__object)
+    return bounty_hunters
+
+
+@benchmark
+def bounty_hunters(out, games=10, charactors=50, missions=1000):
+    '''
+    Bounty.get_bounty_hunters with games * missions Missions in the
+    database, against the old whole-table scan.
+    '''
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from api.models import Game, Player, Charactor, Mission, Bounty
+
+    p = Player(unique_name='bench bounty_hunters')
+    p.save()
+    target = None
+    for i in range(games):
+        g = Game(name='bench bounty_hunters %d' % i)
+        g.save()
+        Charactor.objects.bulk_create([
+            Charactor(game=g, player=p) for _ in range(charactors)])
+        cids = list(Charactor.objects.filter(game=g).values_list('id', flat=True))
+        batch = []
+        for n in range(missions):
+            m = Mission(game=g)
+            # Every tenth mission is still active, like a long game
+            m.lazy_set(hunter=str(cids[(n // 10) % charactors]),
+                       prey=str(cids[(n * 7 + 1) % charactors]),
+                       active=n % 10 == 0)
+            m.freeze_db_attrs()
+            batch.append(m)
+        Mission.objects.bulk_create(batch, batch_size=500)
+        target = Charactor.objects.get(id=cids[1])
+
+    out.write('bounty_hunters: %d games, %d Missions\n' % (
+        games, games * missions))
+    for label, fn in [('indexed', Bounty.get_bounty_hunters),
+                      ('legacy scan', legacy_bounty_hunters)]:
+        with CaptureQueriesContext(connection) as queries:
+            hunters = fn(target)
+        seconds = best_of(lambda: fn(target), repeat=3)
+        report(out, '%s (%d hunters, %d queries)' % (
+            label, len(hunters), len(queries)), seconds)
+
+
+def run_threads(count, fn):
+    import threading
+    from django.db import connection
+
+    def run():
+        try:
+            fn()
+        finally:
+            connection.close()
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start
+
+
+@benchmark
+@committing
+def coin_payouts(out, threads=8, payouts=50):
+    '''
+    Parallel payouts to one Charactor through the coin ledger, and through
+    the old read-modify-write of a coin kept in db_attrs.
+    '''
+    from api.models import Game, Player, Charactor, CoinTransaction
+
+    g = Game(name='bench coin_payouts')
+    g.save()
+    p = Player(unique_name='bench coin_payouts')
+    p.save()
+    c = Charactor(game=g, player=p)
+    c.save()
+    expected = threads * payouts
+    out.write('coin_payouts: %d threads x %d payouts of 1 coin\n' % (
+        threads, payouts))
+    try:
+        def ledger():
+            mine = Charactor.objects.get(pk=c.pk)
+            for _ in range(payouts):
+                mine.add_coin(1, 'bench')
+
+        def legacy():
+            for _ in range(payouts):
+                mine = Charactor.objects.get(pk=c.pk)
+                mine.lazy_set(bench_coin=mine._jdict.get('bench_coin', 0) + 1)
+                mine.save()
+
+        seconds = run_threads(threads, ledger)
+        balance = Charactor.objects.get(pk=c.pk).coin
+        txns = CoinTransaction.objects.filter(charactor=c)
+        total = txns.aggregate(total=models.Sum('amount'))['total'] or 0
+        report(out, 'ledger: balance %d/%d, %d rows' % (
+            balance, expected, txns.count()), seconds, expected)
+        if balance != expected or total != expected:
+            raise BenchmarkFailed(
+                'coin_payouts: lost payouts, balance %d and ledger %d of %d'
+                % (balance, total, expected))
+
+        seconds = run_threads(threads, legacy)
+        balance = Charactor.objects.get(pk=c.pk)._jdict.get('bench_coin', 0)
+        report(out, 'read-modify-write: balance %d/%d' % (
+            balance, expected), seconds, expected)
+    finally:
+        g.delete()
+        p.delete()
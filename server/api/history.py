@@ -0,0 +1,303 @@
+# api.history
+
+'''
+Game history, event sourced.  Every state-changing API action appends one
+small Event to its game.  A game's state at any point can be rebuilt by
+replaying its events in id order, and a GameSnapshot stores that state as
+of some event, so a rebuild starts from the newest snapshot and replays only
+the events after it.
+
+Games that were already going when history started being kept got a
+baseline() snapshot of their rows at event 0 from migration 0016.
+
+The rebuilt state is a plain dict of the things players see:
+
+    started      has the game been started
+    over         has it finished
+    charactors   {id: {name, coin, activity, mission}}
+    invites      {id: {player, by, state}}
+    missions     {id: {hunter, prey, stunt, state}}
+    submissions  {id: {mission, hunter, judges, judgement, dismissed}}
+    bounties     {id: {poster, target, coin, claimed}}
+    event        id of the last event folded in
+
+Ids are strings, the way they are in db_attrs.  Events carry what changed
+(coin paid out, bounties claimed) rather than the rules used to work it
+out, so an old game replays the same after the rules change.
+'''
+
+import functools
+import operator
+
+from django.apps import apps
+from django.db import models
+
+from api import jasoncodec
+
+# manage.py snapshot_games snapshots a game once it has this many events
+# after its last snapshot
+SNAPSHOT_EVERY = 200
+
+# Games checked per query by games_due_a_snapshot
+SNAPSHOT_CHUNK = 200
+
+REDUCERS = {}
+
+
+def record(game, name, charactor=None, **data):
+    '''
+    Append an Event to game's history
+    '''
+    Event = apps.get_model('api', 'Event')
+    e = Event(game_id=getattr(game, 'pk', game))
+    e.name = name
+    e.charactor = charactor
+    e.data = data
+    e.save()
+    return e
+
+
+def reducer(name):
+    def register(fn):
+        REDUCERS[name] = fn
+        return fn
+    return register
+
+
+def empty_state():
+    return dict(started=False, over=False, charactors={}, invites={},
+                missions={}, submissions={}, bounties={}, event=None)
+
+
+def apply(state, event):
+    fn = REDUCERS.get(event.name)
+    if fn is not None:
+        fn(state, event.charactor, event.data)
+    state['event'] = event.id
+    return state
+
+
+def last_snapshot(game_id, upto=None):
+    GameSnapshot = apps.get_model('api', 'GameSnapshot')
+    snaps = GameSnapshot.objects.filter(game_id=game_id)
+    if upto is not None:
+        snaps = snaps.filter(event_id__lte=upto)
+    return snaps.order_by('-event_id').first()
+
+
+def state_at(game_id, upto=None, at=None):
+    '''
+    The game's state after event id upto, or as of datetime at, or now
+    '''
+    Event = apps.get_model('api', 'Event')
+    events = Event.objects.filter(game_id=game_id)
+    if at is not None:
+        upto = events.filter(_created__lte=at).aggregate(
+            last=models.Max('id'))['last'] or 0
+    snap = last_snapshot(game_id, upto)
+    if snap is None:
+        state = empty_state()
+    else:
+        state = snap.get_state()
+        events = events.filter(id__gt=snap.event_id)
+    if upto is not None:
+        events = events.filter(id__lte=upto)
+    for e in events.order_by('id').iterator():
+        apply(state, e)
+    return state
+
+
+def snapshot(game_id):
+    '''
+    Store the game's current state.  Returns the GameSnapshot, or None if
+    nothing has happened since the last one.
+    '''
+    GameSnapshot = apps.get_model('api', 'GameSnapshot')
+    state = state_at(game_id)
+    snap = last_snapshot(game_id)
+    if state['event'] is None or (snap and snap.event_id == state['event']):
+        return None
+    return GameSnapshot.objects.create(
+        game_id=game_id, event_id=state['event'],
+        state=jasoncodec.get_codec().dumps(state))
+
+
+def baseline(apps, game_id):
+    '''
+    A game's state read straight from its rows, for games that were already
+    going before history was kept.  Takes an app registry so migrations can
+    use it with their historical models.
+    '''
+    get = lambda name: apps.get_model('api', name).objects
+    attrs = lambda db_attrs: jasoncodec.loads(db_attrs or '{}')
+    state = empty_state()
+    game = get('Game').get(pk=game_id)
+    state['started'] = bool(attrs(game.db_attrs).get('started'))
+    active = dict(get('Mission').filter(
+        game=game_id, ix_active=True).values_list('ix_hunter', 'id'))
+    for cid, activity, coin, db_attrs in get('Charactor').filter(
+            game=game_id).values_list('id', 'ix_activity', 'coin', 'db_attrs'):
+        mission = active.get(cid)
+        state['charactors'][str(cid)] = dict(
+            name=attrs(db_attrs).get('c_name', ''), coin=coin,
+            activity=activity, mission=str(mission) if mission else None)
+    for iid, db_attrs in get('Invite').filter(
+            game=game_id).values_list('id', 'db_attrs'):
+        d = attrs(db_attrs)
+        state['invites'][str(iid)] = dict(
+            player=d.get('created_for'), by=d.get('created_by'),
+            state=d.get('state', 'null'))
+    for mid, db_attrs in get('Mission').filter(
+            game=game_id).exclude(ix_state__in=('offered', 'expired')
+            ).values_list('id', 'db_attrs'):
+        d = attrs(db_attrs)
+        state['missions'][str(mid)] = dict(
+            hunter=d.get('hunter'), prey=d.get('prey'), stunt=d.get('stunt'),
+            state='accepted' if d.get('active') else 'complete')
+    for sid, db_attrs in get('Submission').filter(
+            game=game_id).values_list('id', 'db_attrs'):
+        d = attrs(db_attrs)
+        state['submissions'][str(sid)] = dict(
+            mission=d.get('mission'), hunter=d.get('hunter'),
+            judges=d.get('judges', []), judgement=d.get('judgement'),
+            dismissed=bool(d.get('dismissed')))
+    for bid, target, db_attrs in get('Bounty').filter(
+            game=game_id).values_list('id', 'target', 'db_attrs'):
+        d = attrs(db_attrs)
+        state['bounties'][str(bid)] = dict(
+            poster=d.get('poster'), target=str(target), coin=d.get('coin', 0),
+            claimed=bool(d.get('claimed')))
+    return state
+
+
+def games_due_a_snapshot(every=SNAPSHOT_EVERY):
+    '''
+    Ids of the games with at least every events after their last snapshot
+    '''
+    Event = apps.get_model('api', 'Event')
+    GameSnapshot = apps.get_model('api', 'GameSnapshot')
+    last = dict(GameSnapshot.objects.order_by().values_list('game').annotate(
+        models.Max('event_id')))
+    pending = lambda events: events.order_by().values_list('game').annotate(
+        n=models.Count('id')).filter(n__gte=every)
+    # Never snapshotted: all their events are pending
+    for game_id, n in pending(Event.objects.exclude(
+            game__gamesnapshot__isnull=False)):
+        yield game_id
+    snapped = sorted(last.items())
+    for i in range(0, len(snapped), SNAPSHOT_CHUNK):
+        after = functools.reduce(operator.or_, [
+            models.Q(game=game_id, id__gt=event_id)
+            for game_id, event_id in snapped[i:i + SNAPSHOT_CHUNK]])
+        for game_id, n in pending(Event.objects.filter(after)):
+            yield game_id
+
+
+# Reducers --------------------------------------------------------------
+# One per event name: fold the event into state, in place.  A game can
+# have rows from before its history was kept, so anything an event names
+# that isn't in state yet is added with blank details rather than
+# failing the whole replay.
+
+def charactor_in(state, cid):
+    return state['charactors'].setdefault(cid, dict(
+        name='', coin=0, activity='choosing_mission', mission=None))
+
+
+def mission_in(state, mid):
+    return state['missions'].setdefault(mid, dict(
+        hunter=None, prey=None, stunt=None, state='accepted'))
+
+
+def submission_in(state, sid):
+    return state['submissions'].setdefault(sid, dict(
+        mission=None, hunter=None, judges=[], judgement=None,
+        dismissed=False))
+
+
+def bounty_in(state, bid):
+    return state['bounties'].setdefault(bid, dict(
+        poster=None, target=None, coin=0, claimed=False))
+
+
+@reducer('game_start')
+def game_started(state, charactor, data):
+    state['started'] = True
+    for cid, name in data['charactors'].items():
+        state['charactors'][cid] = dict(
+            name=name, coin=data['coin'], activity='choosing_mission',
+            mission=None)
+
+
+@reducer('game_over')
+def game_ended(state, charactor, data):
+    state['over'] = True
+
+
+@reducer('invite')
+def invited(state, charactor, data):
+    for iid, player in data['invites'].items():
+        state['invites'][iid] = dict(player=player, by=data['by'],
+                                     state='queued')
+
+
+@reducer('invite_answer')
+def invite_answered(state, charactor, data):
+    state['invites'].setdefault(data['invite'], {})['state'] = data['state']
+
+
+@reducer('mission_accept')
+def mission_accepted(state, charactor, data):
+    state['missions'][data['mission']] = dict(
+        hunter=charactor, prey=data['prey'], stunt=data['stunt'],
+        state='accepted')
+    charactor_in(state, charactor).update(
+        activity='hunting', mission=data['mission'])
+
+
+@reducer('submit')
+def submitted(state, charactor, data):
+    state['submissions'][data['submission']] = dict(
+        mission=data['mission'], hunter=charactor, judges=data['judges'],
+        judgement=None, dismissed=False)
+    charactor_in(state, charactor)['activity'] = 'awaiting_judgement'
+
+
+@reducer('judge')
+def judged(state, charactor, data):
+    s = submission_in(state, data['submission'])
+    s['judgement'] = data['judgement']
+    for cid, amount in data['pay'].items():
+        charactor_in(state, cid)['coin'] += amount
+    for bid in data['bounties']:
+        bounty_in(state, bid)['claimed'] = True
+    if data['judgement'] and s['mission'] is not None:
+        mission_in(state, s['mission'])['state'] = 'complete'
+    if s['hunter'] is not None:
+        charactor_in(state, s['hunter'])['activity'] = 'submission_finished'
+
+
+@reducer('take_judging')
+def judging_taken(state, charactor, data):
+    judges = submission_in(state, data['submission'])['judges']
+    if str(charactor) not in judges:
+        judges.append(str(charactor))
+
+
+@reducer('dismiss')
+def dismissed(state, charactor, data):
+    s = submission_in(state, data['submission'])
+    s['dismissed'] = True
+    if s['judgement']:
+        charactor_in(state, charactor).update(
+            activity='choosing_mission', mission=None)
+    else:
+        charactor_in(state, charactor)['activity'] = 'hunting'
+
+
+@reducer('bounty')
+def bounty_posted(state, charactor, data):
+    state['bounties'][data['bounty']] = dict(
+        poster=charactor, target=data['target'], coin=data['coin'],
+        claimed=False)
+    charactor_in(state, charactor)['coin'] -= data['coin']
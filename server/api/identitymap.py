@@ -0,0 +1,46 @@
+# api.identitymap
+
+'''
+A request-scoped identity map for the objects LazyJason resolves from the
+stringified ids it keeps in db_attrs.  While a map is open, asking for the
+same (model, id) twice returns the same instance without another query.
+
+IdentityMapMiddleware opens a map at the start of every request and throws
+it away at the end.  Outside of a request (shell, scripts) no map is open
+and every lookup goes to the database like it always did.
+'''
+
+import threading
+
+_local = threading.local()
+
+
+def begin():
+    _local.objects = {}
+
+
+def end():
+    _local.objects = None
+
+
+def is_open():
+    return getattr(_local, 'objects', None) is not None
+
+
+def _key(cls, objid):
+    return (cls._meta.concrete_model, int(objid))
+
+
+def get(cls, objid):
+    objects = getattr(_local, 'objects', None)
+    if objects is None or objid is None:
+        return None
+    return objects.get(_key(cls, objid))
+
+
+def add(obj):
+    objects = getattr(_local, 'objects', None)
+    if objects is None or obj.pk is None:
+        return obj
+    objects[_key(type(obj), obj.pk)] = obj
+    return obj
@@ -0,0 +1,82 @@
+# api.instrument
+
+'''
+Counters and leveled tracing for the LazyJason hot paths, instead of
+print statements.
+
+    instrument.count('load', 'Charactor')
+    instrument.trace(instrument.DEBUG, 'froze %s', obj)
+
+Counters are kept per (event, model) for the whole process and, while
+InstrumentMiddleware has a request open, for the current request too.
+
+Tracing goes to the 'api.trace' logger.  Nothing at or below the current
+level is even formatted, so a disabled trace() is one comparison.  Change
+the level at runtime with set_level(); LAZYJASON_TRACE_LEVEL in settings
+is the starting level.
+'''
+
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+TRACE = 5
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+OFF = logging.CRITICAL + 10
+
+logging.addLevelName(TRACE, 'TRACE')
+logger = logging.getLogger('api.trace')
+
+_local = threading.local()
+
+totals = Counter()
+level = getattr(settings, 'LAZYJASON_TRACE_LEVEL', WARNING)
+
+
+def set_level(new_level):
+    global level
+    if isinstance(new_level, basestring):
+        new_level = logging.getLevelName(new_level.upper())
+    level = new_level
+
+
+def tracing(at_level):
+    return at_level >= level
+
+
+def trace(at_level, msg, *args):
+    if at_level >= level:
+        logger.log(at_level, msg, *args)
+
+
+def count(event, model):
+    key = (event, model)
+    totals[key] += 1
+    counts = getattr(_local, 'counts', None)
+    if counts is not None:
+        counts[key] += 1
+
+
+def begin_request():
+    _local.counts = Counter()
+
+
+def end_request():
+    counts = getattr(_local, 'counts', None)
+    _local.counts = None
+    return counts or Counter()
+
+
+def request_counts():
+    return getattr(_local, 'counts', None) or Counter()
+
+
+def as_dict(counter):
+    result = {}
+    for (event, model), n in counter.items():
+        result.setdefault(model, {})[event] = n
+    return result
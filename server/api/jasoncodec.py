@@ -0,0 +1,116 @@
+# api.jasoncodec
+
+'''
+Codecs that turn a LazyJason _jdict into the db_attrs string and back.
+
+    json      stdlib json, what db_attrs has always been
+    fastjson  reads with ujson / simplejson when installed, else json
+    zlib      json, deflated and base64'd once it is bigger than
+              ZLIB_THRESHOLD bytes
+
+A codec that changes the stored format prefixes the row with its tag and a
+colon ('z:eJyr...').  Plain JSON always starts with '{', so rows with no
+prefix are read as JSON.  Any row can be read no matter which codec the
+model writes with, and tables with mixed codecs keep working.
+
+Pick the codec with _lazy_codec on the model, or LAZYJASON_CODEC in
+settings for every model that doesn't say.
+'''
+
+import json
+import zlib
+import base64
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+ZLIB_THRESHOLD = 1024
+
+
+def date_handler(obj):
+    return obj.isoformat() if hasattr(obj, 'isoformat') else obj
+
+
+class JsonCodec(object):
+    tag = None
+
+    def dumps(self, d):
+        return json.dumps(d, default=date_handler)
+
+    def loads(self, s):
+        return json.loads(s)
+
+
+class FastJsonCodec(JsonCodec):
+    '''
+    Reads with ujson or simplejson when one is installed.  Writing stays
+    on the stdlib encoder: it is as fast as either on py2.7 and, unlike
+    ujson, has a default= hook for datetimes.  The output is the same
+    plain JSON as JsonCodec, so it needs no tag.
+    '''
+    def loads(self, s):
+        if ujson is not None:
+            return ujson.loads(s)
+        if simplejson is not None:
+            return simplejson.loads(s)
+        return json.loads(s)
+
+
+class ZlibCodec(JsonCodec):
+    tag = 'z'
+
+    def __init__(self, threshold=ZLIB_THRESHOLD):
+        self.threshold = threshold
+
+    def dumps(self, d):
+        raw = super(ZlibCodec, self).dumps(d)
+        if len(raw) < self.threshold:
+            return raw
+        return self.tag + ':' + base64.b64encode(zlib.compress(raw))
+
+    def loads(self, s):
+        return super(ZlibCodec, self).loads(zlib.decompress(base64.b64decode(s)))
+
+
+CODECS = dict(
+    json = JsonCodec(),
+    fastjson = FastJsonCodec(),
+    zlib = ZlibCodec(),
+)
+
+_by_tag = dict((c.tag, c) for c in CODECS.values() if c.tag)
+
+
+def get_codec(name=None):
+    name = name or getattr(settings, 'LAZYJASON_CODEC', 'json')
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ImproperlyConfigured('Unknown LazyJason codec %r' % name)
+
+
+def loads(s, codec=None):
+    '''
+    Decode a db_attrs string written by any codec.  Raises ValueError when
+    it can't be decoded, like json.loads does.
+    '''
+    if not s.startswith('{'):
+        tag, sep, payload = s.partition(':')
+        if sep and tag in _by_tag:
+            try:
+                return _by_tag[tag].loads(payload)
+            except (TypeError, zlib.error) as e:
+                raise ValueError('Bad %s: db_attrs: %s' % (tag, e))
+    if codec is None or codec.tag is not None:
+        codec = CODECS['json']
+    return codec.loads(s)
@@ -0,0 +1,70 @@
+# api.judging
+
+'''
+Judge assignment.  Every Charactor in a game is scored by how many
+submissions are already waiting on them plus how slow they have been to
+judge lately, and new submissions go to the lowest scores.
+
+Both numbers are real Charactor columns kept up to date in SQL, so a
+scheduler is built from one narrow query and never decodes db_attrs.
+'''
+
+import heapq
+import random
+
+from django.apps import apps
+from django.db import models
+
+# Seconds of average judging time that count as much as one more
+# submission in the queue
+LATENCY_UNIT = 600.0
+
+# Weight of the newest judging time in judge_latency
+LATENCY_ALPHA = 0.3
+
+
+def score(depth, latency):
+    return depth + (latency or 0.0) / LATENCY_UNIT
+
+
+class JudgeScheduler(object):
+    '''
+    A priority queue of one game's charactors, least loaded first
+    '''
+    def __init__(self, game_id):
+        Charactor = apps.get_model('api', 'Charactor')
+        rows = Charactor.objects.filter(game_id=game_id).values_list(
+            'id', 'judge_queue_depth', 'judge_latency')
+        # The random number breaks ties, so equally idle judges share
+        self.heap = [(score(depth, latency), random.random(), cid)
+                     for cid, depth, latency in rows]
+        heapq.heapify(self.heap)
+
+    def pick(self, count, exclude=()):
+        '''
+        The ids of the count least loaded charactors not in exclude.  They
+        are charged one more submission, so picking again spreads the work.
+        '''
+        picked = []
+        skipped = []
+        while self.heap and len(picked) < count:
+            item = heapq.heappop(self.heap)
+            if item[2] in exclude:
+                skipped.append(item)
+            else:
+                picked.append(item)
+        for item in skipped:
+            heapq.heappush(self.heap, item)
+        for s, tie, cid in picked:
+            heapq.heappush(self.heap, (s + 1, tie, cid))
+        return [cid for _, _, cid in picked]
+
+
+def record_latency(charactor_ids, seconds):
+    '''
+    Fold one judging time into each charactor's moving average
+    '''
+    Charactor = apps.get_model('api', 'Charactor')
+    Charactor.objects.filter(pk__in=charactor_ids).update(judge_latency=(
+        models.F('judge_latency') * (1 - LATENCY_ALPHA)
+        + LATENCY_ALPHA * seconds))
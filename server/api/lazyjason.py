@@ -1,59 +1,414 @@
 # api.lazyjason
 
-import json
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models, connection, connections, router, transaction
+from django.db.models.signals import class_prepared
+
+from api import identitymap
+from api import instrument
+from api import jasoncodec
+from api.instrument import trace, TRACE, WARNING
+
+
+try:
+    import psycopg2.extras
+except ImportError:
+    pass
+else:
+    # psycopg2 parses jsonb columns into dicts by default.  LazyJason wants
+    # the raw string so it can put off decoding until it is needed.
+    psycopg2.extras.register_default_jsonb(loads=lambda s: s, globally=True)
+
+# Most ids filter_lazy() puts in one IN () on databases without jsonb
+IN_CHUNK = 500
+
+
+class LazyJsonField(models.TextField):
+    '''
+    The db_attrs column.  jsonb on PostgreSQL, so the database can index
+    and filter inside it; plain text everywhere else.
+    '''
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(LazyJsonField, self).db_type(connection)
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is not None and not isinstance(value, basestring):
+            # psycopg2 decoded it anyway, eg. on a connection made before
+            # this module was imported.
+            value = jasoncodec.CODECS['json'].dumps(value)
+        return value
+
+
+class JsonValue(models.Value):
+    '''
+    A db_attrs document as a literal, eg. in a CASE.  PostgreSQL won't put
+    text in a jsonb column without a cast.
+    '''
+    def as_postgresql(self, compiler, connection):
+        sql, params = self.as_sql(compiler, connection)
+        return sql + '::jsonb', params
+
+
+class Lazy(object):
+    '''
+    Declares one lazy key in _lazy_defaults when a bare default isn't enough:
+
+        potential_missions = Lazy([], ref='Mission'),
+
+    type is what assigned values are coerced to; it is guessed from the
+    default if not given.  ref names the model the key holds ids of, which
+    also compiles the potential_missions_Mission__objects accessor.
+    '''
+    def __init__(self, default=None, type=None, ref=None):
+        if type is None and default is not None:
+            type = basestring if isinstance(default, basestring) else default.__class__
+        self.default = default
+        self.type = type
+        self.ref = ref
+        self.many = isinstance(default, list)
+
+    def make_default(self):
+        # Every instance gets its own copy, so appending to one Charactor's
+        # potential_missions can't leak into every other Charactor.
+        if isinstance(self.default, list):
+            return list(self.default)
+        if isinstance(self.default, dict):
+            return dict(self.default)
+        return self.default
+
+    def coerce(self, val):
+        if val is None:
+            return val
+        if self.ref is not None or isinstance(val, LazyJason):
+            # References are stored as stringed ids
+            if self.many:
+                return [_ref_id(x) for x in val]
+            return _ref_id(val)
+        if self.many and val and isinstance(val[0], LazyJason):
+            return [_ref_id(x) for x in val]
+        if self.type is None or isinstance(val, self.type):
+            return val
+        if self.type is basestring:
+            # basestring is only for the isinstance check above
+            return unicode(val)
+        return self.type(val)
+
+
+def _ref_id(val):
+    if isinstance(val, LazyJason):
+        return str(val.id)
+    return None if val is None else str(val)
+
+
+class LazyAttribute(object):
+    '''
+    Compiled accessor for a declared lazy key.  Being a data descriptor it
+    wins over the instance dict, so neither reads nor writes of the many
+    other attributes go through __getattr__ / __setattr__.
+    '''
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        jdict = obj.__dict__.get('_jdict')
+        if jdict is None:
+            jdict = obj._jdict
+        try:
+            return jdict[self.name]
+        except KeyError:
+            val = jdict[self.name] = self.spec.make_default()
+            return val
+
+    def __set__(self, obj, val):
+        spec = self.spec
+        if val is not None and (spec.ref is not None or spec.type is None
+                                or not isinstance(val, spec.type)):
+            val = spec.coerce(val)
+        if TRACE >= instrument.level:
+            trace(TRACE, '%s.%s = %r', type(obj).__name__, self.name, val)
+        d = obj.__dict__
+        jdict = d.get('_jdict')
+        if jdict is None:
+            jdict = obj._jdict
+        jdict[self.name] = val
+        # Same as obj.touch(self.name)
+        d['_dirty'].add(self.name)
+        d['_stale'] = True
+
+
+class LazyReference(object):
+    '''
+    Compiled attr_Class__object / attr_Class__objects accessor for a lazy
+    key declared with ref=.  Read only.
+    '''
+    def __init__(self, attrname, many):
+        self.attrname = attrname
+        self.many = many
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        if self.many:
+            return obj.lookup_objects_by_id(self.attrname, obj._jdict)
+        return obj.lookup_object_by_id(self.attrname, obj._jdict)
 
 
 class LazyJason(object):
+    # Lazy keys and their defaults.  A value can be a plain default or a
+    # Lazy() for keys that need a type or refer to other objects.
     _lazy_defaults = {}
+    _lazy_schema = {}
+    _lazy_codec = None  # None means settings.LAZYJASON_CODEC, see jasoncodec
+
+    # Lazy keys that are also mirrored into a real, indexed column so they
+    # can be filtered on in SQL.  Every key here needs an 'ix_<key>' field
+    # on the model; it is kept in sync whenever db_attrs is frozen.
+    _lazy_indexed = ()
+
+    # Columns that only ever change through add_to_columns().  save() never
+    # writes them, so a stale copy of the row can't undo a concurrent update.
+    _sql_maintained = ()
 
     def load(self):
-        self._orig_db_attrs = self.db_attrs
-        if hasattr(self, '_jdict'):
+        '''
+        Called once the instance has been built.  db_attrs isn't decoded
+        here: that waits until the first lazy attribute is read, so loops
+        that only look at real columns never pay for the json.loads.
+        '''
+        if '_dirty' in self.__dict__:
             return
-        #print 'trying to load', self.db_attrs
+        self._orig_db_attrs = self.db_attrs
+        self._dirty = set()
+        self._stale = self.db_attrs == '{}'
+        self.snapshot_columns()
+
+    def decode_db_attrs(self):
+        instrument.count('load', type(self).__name__)
         try:
-            self._jdict = json.loads(self.db_attrs)
+            jdict = jasoncodec.loads(self.db_attrs, self.codec())
         except ValueError:
-            print 'Corrupt db_attrs'
-        for key, val in self._lazy_defaults.items():
-            if key not in self._jdict:
-                self._jdict[key] = val
+            trace(WARNING, 'Corrupt db_attrs on %s %s', type(self).__name__,
+                  self.pk)
+            jdict = {}
+        for key, spec in self._lazy_schema.items():
+            if key not in jdict:
+                jdict[key] = spec.make_default()
+        self.__dict__['_jdict'] = jdict
+        return jdict
+
+    @classmethod
+    def compile_schema(cls):
+        '''
+        Turn _lazy_defaults into _lazy_schema and install a LazyAttribute
+        for every key, plus a LazyReference for every ref.  Runs once per
+        model class, from class_prepared.
+        '''
+        field_names = set()
+        if hasattr(cls, '_meta'):
+            field_names = set(f.attname for f in cls._meta.local_fields)
+        schema = {}
+        for name, spec in cls._lazy_defaults.items():
+            if not isinstance(spec, Lazy):
+                spec = Lazy(spec)
+            if name in field_names:
+                raise ImproperlyConfigured(
+                    '%s lazy key %r clashes with a field' % (cls.__name__, name))
+            schema[name] = spec
+            setattr(cls, name, LazyAttribute(name, spec))
+            if spec.ref is not None:
+                attrname = '%s_%s__%s' % (
+                    name, spec.ref, 'objects' if spec.many else 'object')
+                setattr(cls, attrname, LazyReference(attrname, spec.many))
+        cls._lazy_schema = schema
+
+    @classmethod
+    def codec(cls):
+        codec = jasoncodec.get_codec(cls._lazy_codec)
+        if codec.tag and cls.stores_jsonb(connection):
+            # jsonb only takes plain JSON
+            return jasoncodec.CODECS['json']
+        return codec
+
+    @classmethod
+    def stores_jsonb(cls, conn):
+        return (conn.vendor == 'postgresql'
+                and isinstance(cls._meta.get_field('db_attrs'), LazyJsonField))
+
+    @property
+    def is_decoded(self):
+        return '_jdict' in self.__dict__
 
     def freeze_db_attrs(self):
         if self.db_attrs != self._orig_db_attrs:
             # Someone has gone in raw and changed db_attrs.  It was probably
             # the Django admin interface.
-            # Or else it was multiple calls to save()
-            print '--'
-            print 'Lost track of the source of truth on ', self
-            print '--'
             try:
-                self._jdict = json.loads(self.db_attrs)
-                print 'db_attrs clobbers _jdict'
+                jasoncodec.loads(self.db_attrs)
             except ValueError:
-                print 'db_attrs invalid, _jdict clobbers db_attrs'
+                trace(WARNING, 'Lost track of the source of truth on %r: '
+                      'db_attrs invalid, _jdict clobbers db_attrs', self)
+                self.db_attrs = self._orig_db_attrs
+                self._stale = True
+            else:
+                trace(WARNING, 'Lost track of the source of truth on %r: '
+                      'db_attrs clobbers _jdict', self)
+                self.__dict__.pop('_jdict', None)
+                self._orig_db_attrs = self.db_attrs
+                self.sync_indexed_columns()
+            # Either way the whole document has to be written, not a patch
+            self._dirty.clear()
 
-        if self.db_attrs == '{}':
-            # Brand new in the original packaging
-            dba = self._lazy_defaults.copy()
-        else:
-            # We may have added some items to _lazy_defaults since last save
-            dba = json.loads(self.db_attrs)
-            print 'non default dba', dba
-            for key,val in self._lazy_defaults.items():
-                if key not in dba:
-                    print 'key %s was not in dba' % key
-                    dba[key] = val
-        if hasattr(self, '_jdict'):
-            dba.update(self._jdict)
-        else:
-            print 'SHOULD NOT GET HERE'
+        if not self._stale:
+            # Nothing was lazy_set since the last freeze, so db_attrs is
+            # already an exact dump of _jdict.
+            return
+
+        # _jdict was built from db_attrs plus _lazy_defaults, so it is the
+        # whole truth and there is no need to re-parse db_attrs.
+        instrument.count('freeze', type(self).__name__)
+        self.db_attrs = self.codec().dumps(self._jdict)
+        self._orig_db_attrs = self.db_attrs
+        self._stale = False
+        self.sync_indexed_columns()
+
+    @classmethod
+    def indexed_fields(cls):
+        fields = cls.__dict__.get('_indexed_fields')
+        if fields is None:
+            fields = []
+            for key in cls._lazy_indexed:
+                try:
+                    field = cls._meta.get_field('ix_' + key)
+                except FieldDoesNotExist:
+                    raise ImproperlyConfigured(
+                        '%s._lazy_indexed has %r but no ix_%s field' % (
+                            cls.__name__, key, key))
+                fields.append((key, field))
+            cls._indexed_fields = fields
+        return fields
 
-        self.db_attrs = json.dumps(dba, default=date_handler)
+    def sync_indexed_columns(self):
+        for key, field in self.indexed_fields():
+            val = field.to_python(self._jdict.get(key))
+            if getattr(self, field.attname) != val:
+                setattr(self, field.attname, val)
+
+    @classmethod
+    def column_names(cls):
+        names = cls.__dict__.get('_column_names')
+        if names is None:
+            names = tuple(f.attname for f in cls._meta.concrete_fields
+                          if not f.primary_key
+                          and f.attname not in cls._sql_maintained)
+            cls._column_names = names
+        return names
+
+    @classmethod
+    def add_to_columns(cls, pk, instance=None, condition=None, **deltas):
+        '''
+        Add to _sql_maintained columns with a single UPDATE ... SET col =
+        col + n, so concurrent writers can't lose each other's changes.
+        condition is extra filter() kwargs the row has to match, eg.
+        dict(coin__gte=10); returns False if it didn't and nothing changed.
+        instance, or else the row's copy in the identity map, is refreshed
+        to show the result.
+        '''
+        names = list(deltas)
+        rows = cls.objects.filter(pk=pk)
+        updated = rows.filter(**condition or {}).update(**dict(
+            (name, models.F(name) + deltas[name]) for name in names))
+        if instance is None:
+            instance = identitymap.get(cls, pk)
+        if instance is not None:
+            for name, val in zip(names, rows.values_list(*names).get()):
+                setattr(instance, name, val)
+        return bool(updated)
+
+    def snapshot_columns(self):
+        self._saved_columns = dict(
+            (name, getattr(self, name, None)) for name in self.column_names()
+        )
+
+    def changed_columns(self):
+        self.freeze_db_attrs()
+        saved = self._saved_columns
+        return [name for name in self.column_names()
+                if getattr(self, name, None) != saved.get(name)]
+
+    @classmethod
+    def bulk_save(cls, instances):
+        '''
+        save() for many rows that already exist, with a single UPDATE that
+        sets every changed column through a CASE on the primary key.
+        '''
+        changed = {}
+        for obj in instances:
+            for name in obj.changed_columns():
+                changed.setdefault(name, []).append(obj)
+        if changed:
+            instrument.count('bulk_save', cls.__name__)
+            updates = {}
+            for name, objs in changed.items():
+                field = cls._meta.get_field(name)
+                value = JsonValue if isinstance(field, LazyJsonField) else models.Value
+                updates[name] = models.Case(*[
+                    models.When(pk=obj.pk, then=value(getattr(obj, name)))
+                    for obj in objs
+                ], default=models.F(name), output_field=field)
+            cls.objects.filter(pk__in=[obj.pk for obj in instances]).update(
+                **updates)
+        for obj in instances:
+            obj.mark_clean()
+            identitymap.add(obj)
+
+    def mark_clean(self, update_fields=None):
+        if update_fields is None:
+            self._dirty.clear()
+            self.snapshot_columns()
+            return
+        if 'db_attrs' in update_fields:
+            self._dirty.clear()
+        for name in self.column_names():
+            if name in update_fields:
+                self._saved_columns[name] = getattr(self, name, None)
+
+    def patch_db_attrs(self, using):
+        '''
+        Write only the lazy keys that changed, with one jsonb_set() per key
+        '''
+        conn = connections[using]
+        qn = conn.ops.quote_name
+        dumps = jasoncodec.CODECS['json'].dumps
+        expr = qn('db_attrs')
+        params = []
+        for key in sorted(self._dirty):
+            expr = 'jsonb_set(%s, %%s, %%s::jsonb)' % expr
+            params += [[key], dumps(self._jdict.get(key))]
+        params.append(self.pk)
+        with conn.cursor() as cursor:
+            cursor.execute('UPDATE %s SET %s = %s WHERE %s = %%s' % (
+                qn(self._meta.db_table), qn('db_attrs'), expr,
+                qn(self._meta.pk.column),
+            ), params)
 
     def __getattr__(self, attrname):
-        #if not hasattr(self, '_jdict'):
-        #    print 'LasyJason needs to load() first'
+        # Declared keys never get here, their LazyAttribute answers first.
+        # This only covers decoding, undeclared keys that are in db_attrs
+        # anyway and __object(s) lookups for keys without a ref.
+        if attrname == '_jdict':
+            if '_dirty' not in self.__dict__:
+                # Not load()ed yet, we're still inside Model.__init__
+                raise AttributeError(attrname)
+            return self.decode_db_attrs()
+        if attrname.startswith('_'):
+            # Django probes for things like _game_cache.  Those are never
+            # lazy keys, so don't decode db_attrs just to say no.
+            return object.__getattribute__(self, attrname)
         if attrname in self._jdict:
             return self._jdict[attrname]
         if attrname.endswith('__object'):
@@ -64,30 +419,67 @@ class LazyJason(object):
 
     def lazy_set(self, **kwargs):
         self._jdict.update(kwargs)
+        self.touch(*kwargs)
+
+    def touch(self, *keys):
+        '''
+        Mark lazy keys as modified.  Call this after mutating a list or dict
+        from _jdict in place, otherwise save() won't know it has to write.
+        '''
+        self._dirty.update(keys)
+        self._stale = True
 
-    def __setattr__(self, attrname, val):
-        if hasattr(self, '_jdict') and attrname in self._jdict:
-            if isinstance(val, LazyJason):
-                print 'jdict values should be stringed ids of model objects'
-                val = str(val.id)
-            if isinstance(val, list) and val and isinstance(val[0], LazyJason):
-                print 'jdict values should be stringed ids of model objects'
-                val = [str(x.id) for x in val]
-            print 'a:v', {attrname:val}
-            return self.lazy_set(**{attrname:val})
-        return super(LazyJason, self).__setattr__(attrname, val)
+    def lookup_class(self, clsname):
+        return self._meta.apps.get_model(self._meta.app_label, clsname)
+
+    def lookup_queryset(self, cls):
+        # Referenced objects are from the same game, unless they are global
+        # like MissionStunt
+        try:
+            cls._meta.get_field('game')
+        except FieldDoesNotExist:
+            return cls.objects.all()
+        return cls.objects.filter(game_id=self.game_id)
+
+    def lookup_cached(self, cls, objid):
+        prefetched = self.__dict__.get('_lazy_prefetched')
+        if prefetched is not None:
+            obj = prefetched.get((cls, int(objid)))
+            if obj is not None:
+                return obj
+        return cached_object(cls, objid)
 
     def lookup_objects_by_id(self, attrname, lookup_dict):
         orig_attr_name, clsname, _, _ = attrname.rsplit('_',3)
         objids = lookup_dict[orig_attr_name]
-        obj_set = getattr(self.game, clsname.lower() + '_set')
-        return obj_set.filter(id__in=objids)
+        cls = self.lookup_class(clsname)
+        found = {}
+        missing = []
+        for objid in objids:
+            obj = self.lookup_cached(cls, objid)
+            if obj is None:
+                missing.append(objid)
+            else:
+                found[obj.pk] = obj
+        if missing:
+            instrument.count('lookup', cls.__name__)
+            for obj in self.lookup_queryset(cls).filter(id__in=missing):
+                found[obj.pk] = identitymap.add(obj)
+        return [found[int(x)] for x in objids if int(x) in found]
 
     def lookup_object_by_id(self, attrname, lookup_dict):
         orig_attr_name, clsname, _, _ = attrname.rsplit('_',3)
         objid = lookup_dict[orig_attr_name]
-        obj_set = getattr(self.game, clsname.lower() + '_set')
-        return obj_set.get(id=objid)
+        cls = self.lookup_class(clsname)
+        obj = None
+        if objid is not None:
+            obj = self.lookup_cached(cls, objid)
+        if obj is None:
+            instrument.count('lookup', cls.__name__)
+            obj = identitymap.add(
+                self.lookup_queryset(cls).get(id=objid)
+            )
+        return obj
 
 
     def to_dict(self, *extra_args):
@@ -99,20 +491,233 @@ class LazyJason(object):
         return d
 
 
-def date_handler(obj):
-    return obj.isoformat() if hasattr(obj, 'isoformat') else obj
+class LazyJasonQuerySet(models.QuerySet):
+    '''
+    Adds prefetch_lazy(), the LazyJason version of prefetch_related():
+
+        game.mission_set.prefetch_lazy('prey_Charactor', 'stunt_MissionStunt')
+
+    The referenced objects are fetched right after the queryset is, so
+    m.prey_Charactor__object is served from memory afterwards.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(LazyJasonQuerySet, self).__init__(*args, **kwargs)
+        self._lazy_lookups = ()
+
+    def filter_lazy(self, **kwargs):
+        '''
+        Filter on lazy keys, eg. game.mission_set.filter_lazy(active=True,
+        prey='12').  Keys in _lazy_indexed use their ix_ column.  On
+        PostgreSQL the rest become jsonb containment tests, which the GIN
+        index on db_attrs answers.  Other databases decode the candidate
+        rows in Python instead, which is fine for sqlite in tests.  Either
+        way a row without a key has that key's default.
+        '''
+        model = self.model
+        indexed = dict(model.indexed_fields())
+        qs = self
+        rest = {}
+        for key, val in kwargs.items():
+            if key in indexed:
+                qs = qs.filter(**{'ix_' + key: indexed[key].to_python(val)})
+            else:
+                # As it is stored, eg. stunt=1 as '1'
+                spec = model._lazy_schema.get(key)
+                rest[key] = spec.coerce(val) if spec is not None else val
+        if not rest:
+            return qs
+
+        defaults = dict((key, spec.default)
+                        for key, spec in model._lazy_schema.items())
+        conn = connections[qs.db]
+        if model.stores_jsonb(conn):
+            qn = conn.ops.quote_name
+            column = '%s.%s' % (qn(model._meta.db_table), qn('db_attrs'))
+            dumps = jasoncodec.CODECS['json'].dumps
+            # A row without the key has its default, the way the Python
+            # fallback below reads it
+            where, params = [], []
+            for key, val in sorted(rest.items()):
+                if key in defaults and defaults[key] == val:
+                    where.append('(%s @> %%s::jsonb OR NOT %s ? %%s)'
+                                 % (column, column))
+                    params += [dumps({key: val}), key]
+            contains = dict((key, val) for key, val in rest.items()
+                            if key not in defaults or defaults[key] != val)
+            if contains:
+                where.append('%s @> %%s::jsonb' % column)
+                params.append(dumps(contains))
+            return qs.extra(where=where, params=params)
+
+        ids = []
+        for pk, db_attrs in qs.values_list('pk', 'db_attrs').iterator():
+            try:
+                jdict = jasoncodec.loads(db_attrs)
+            except ValueError:
+                continue
+            if all(jdict.get(key, defaults.get(key)) == val
+                   for key, val in rest.items()):
+                ids.append(int(pk))
+        if not ids:
+            return qs.none()
+        # The ids are written into the SQL, IN_CHUNK to an IN (), instead of
+        # being bound: sqlite allows only 999 bound variables a statement.
+        # They are ints read back from the table, so that is safe.
+        column = '%s.%s' % (conn.ops.quote_name(model._meta.db_table),
+                            conn.ops.quote_name(model._meta.pk.column))
+        where = ' OR '.join(
+            '%s IN (%s)' % (column, ','.join(str(pk) for pk in ids[i:i + IN_CHUNK]))
+            for i in range(0, len(ids), IN_CHUNK))
+        return qs.extra(where=['(%s)' % where])
+
+    def prefetch_lazy(self, *lookups):
+        clone = self._clone()
+        clone._lazy_lookups = self._lazy_lookups + lookups
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(LazyJasonQuerySet, self)._clone(*args, **kwargs)
+        clone._lazy_lookups = self._lazy_lookups
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(LazyJasonQuerySet, self)._fetch_all()
+        if not fetched and self._lazy_lookups:
+            prefetch_lazy_objects(self._result_cache, *self._lazy_lookups)
+
+
+class LazyJasonModel(LazyJason, models.Model):
+    '''
+    Base class for every model that keeps its attributes in db_attrs.
+    LazyJason's bookkeeping is hooked straight into __init__, from_db and
+    save instead of going through post_init / pre_save / post_save signals,
+    so building a row costs no signal dispatch and no model can miss it.
+    '''
+    db_attrs = LazyJsonField(default='{}')
+    objects = LazyJasonQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def __init__(self, *args, **kwargs):
+        super(LazyJasonModel, self).__init__(*args, **kwargs)
+        self.load()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instrument.count('row', cls.__name__)
+        return super(LazyJasonModel, cls).from_db(db, field_names, values)
+
+    def save(self, *args, **kwargs):
+        '''
+        Saves of rows that already exist only write the columns that changed
+        since they were loaded.  If nothing changed, nothing is written.
+        '''
+        if (self.pk is None or self._state.adding or args
+            or 'update_fields' in kwargs or kwargs.get('force_insert')):
+            instrument.count('save', type(self).__name__)
+            self.freeze_db_attrs()
+            super(LazyJasonModel, self).save(*args, **kwargs)
+            self.mark_clean(kwargs.get('update_fields'))
+            identitymap.add(self)
+            return
+        changed = self.changed_columns()
+        if not changed:
+            instrument.count('save_skipped', type(self).__name__)
+            return
+        instrument.count('save', type(self).__name__)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        if ('db_attrs' in changed and self._dirty
+            and self.stores_jsonb(connections[using])):
+            changed.remove('db_attrs')
+            with transaction.atomic(using=using):
+                self.patch_db_attrs(using)
+                if changed:
+                    kwargs['update_fields'] = changed
+                    super(LazyJasonModel, self).save(**kwargs)
+        else:
+            kwargs['update_fields'] = changed
+            super(LazyJasonModel, self).save(**kwargs)
+        self.mark_clean()
+        identitymap.add(self)
+
+
+def cached_object(cls, objid):
+    '''
+    The request's copy of an object, or one from a model's own cache if it
+    has a cached_by_id() classmethod, like MissionStunt.
+    '''
+    obj = identitymap.get(cls, objid)
+    if obj is None and hasattr(cls, 'cached_by_id'):
+        obj = cls.cached_by_id(objid)
+    return obj
+
+
+def prefetch_lazy_objects(instances, *lookups):
+    '''
+    Resolve 'attr_ClassName' lookups for a whole list of LazyJason instances
+    with one id__in query per target class.  Lookups can be chained with
+    '__' to follow the fetched objects, eg. 'mission_Mission__hunter_Charactor'
+    '''
+    instances = [x for x in instances if isinstance(x, LazyJason)]
+    if not instances:
+        return
+
+    follow = {}
+    for lookup in lookups:
+        first, _, rest = lookup.partition('__')
+        follow.setdefault(first, set())
+        if rest:
+            follow[first].add(rest)
+
+    wanted = {}
+    targets = {}
+    for first in follow:
+        attrname, clsname = first.rsplit('_', 1)
+        cls = instances[0].lookup_class(clsname)
+        ids = set()
+        for inst in instances:
+            val = inst._jdict.get(attrname)
+            if isinstance(val, list):
+                ids.update(int(x) for x in val)
+            elif val is not None:
+                ids.add(int(val))
+        targets[first] = (cls, ids)
+        wanted.setdefault(cls, set()).update(ids)
+
+    fetched = {}
+    for cls, ids in wanted.items():
+        missing = []
+        for objid in ids:
+            obj = cached_object(cls, objid)
+            if obj is None:
+                missing.append(objid)
+            else:
+                fetched[(cls, objid)] = obj
+        if missing:
+            instrument.count('lookup', cls.__name__)
+            for obj in cls.objects.filter(id__in=missing):
+                obj = identitymap.get(cls, obj.pk) or identitymap.add(obj)
+                fetched[(cls, obj.pk)] = obj
+
+    for inst in instances:
+        prefetched = inst.__dict__.get('_lazy_prefetched')
+        if prefetched is None:
+            inst.__dict__['_lazy_prefetched'] = fetched
+        elif prefetched is not fetched:
+            prefetched.update(fetched)
 
+    for first, rests in follow.items():
+        if not rests:
+            continue
+        cls, ids = targets[first]
+        next_instances = [fetched[(cls, x)] for x in ids if (cls, x) in fetched]
+        prefetch_lazy_objects(next_instances, *rests)
 
-def pre_save_for_lazies(**kwargs):
-    instance = kwargs.get('instance')
-    print 'in pre save for ', kwargs
-    instance.freeze_db_attrs()
 
-def post_save_for_lazies(**kwargs):
-    instance = kwargs.get('instance')
-    print 'in post save for ', instance
-    instance.load()
+def compile_lazy_schema(sender, **kwargs):
+    if issubclass(sender, LazyJason):
+        sender.compile_schema()
 
-def post_init_for_lazies(**kwargs):
-    instance = kwargs.get('instance')
-    instance.load()
+class_prepared.connect(compile_lazy_schema)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = ('Archive finished games and clear their rows out of the live '
+            'tables, a chunk at a time.  Safe to stop and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='rows per transaction (default: 500)')
+        parser.add_argument('--game', type=int, action='append',
+            help='only this game id (may be given more than once)')
+
+    def handle(self, *args, **options):
+        games = archive.games_to_archive()
+        if options['game']:
+            games = games.filter(id__in=options['game'])
+        for game_id in list(games.values_list('id', flat=True)):
+            for what, n in archive.archive_game(game_id,
+                                                options['chunk_size']):
+                self.stdout.write('game %d: %d %s' % (game_id, n, what))
+            self.stdout.write('game %d: archived' % game_id)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.bench import BENCHMARKS, BenchmarkFailed
+
+
+class Command(BaseCommand):
+    help = 'Run the LazyJason microbenchmarks in api.bench'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+            help='benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError('No benchmark named %r' % name)
+        try:
+            for name in names:
+                fn = BENCHMARKS[name]
+                if not getattr(fn, 'atomic', True):
+                    fn(self.stdout)
+                    continue
+                with transaction.atomic():
+                    fn(self.stdout)
+                    transaction.set_rollback(True)
+        except BenchmarkFailed as e:
+            raise CommandError(str(e))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import history
+
+
+class Command(BaseCommand):
+    help = ('Snapshot the history of every game with enough events since '
+            'its last snapshot')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int,
+            default=history.SNAPSHOT_EVERY,
+            help='events since the last snapshot (default: %d)'
+                 % history.SNAPSHOT_EVERY)
+
+    def handle(self, *args, **options):
+        for game_id in list(history.games_due_a_snapshot(options['every'])):
+            snap = history.snapshot(game_id)
+            if snap is not None:
+                self.stdout.write('game %d: snapshot at event %d'
+                                  % (game_id, snap.event_id))
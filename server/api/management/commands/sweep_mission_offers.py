@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Mission
+
+
+class Command(BaseCommand):
+    help = ('Expire Mission offers nobody took within a day, then delete '
+            'expired offers, a chunk at a time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+            help='rows per transaction (default: 500)')
+        parser.add_argument('--keep-expired', action='store_true',
+            help='only expire stale offers, delete nothing')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        expired = 0
+        for n in Mission.expire_stale_offers(chunk_size):
+            expired += n
+            self.stdout.write('expired %d offers' % expired)
+        if options['keep_expired']:
+            return
+        deleted = 0
+        for n in Mission.delete_expired_offers(chunk_size):
+            deleted += n
+            self.stdout.write('deleted %d offers' % deleted)
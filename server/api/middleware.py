@@ -0,0 +1,47 @@
+# api.middleware
+
+from api import identitymap
+from api import instrument
+from api import players
+
+
+class IdentityMapMiddleware(object):
+    '''
+    Gives every request its own identity map, so repeated
+    *__object / *__objects lookups during a view or a Mako render only
+    query once per (model, id).
+    '''
+    def process_request(self, request):
+        identitymap.begin()
+
+    def process_response(self, request, response):
+        identitymap.end()
+        return response
+
+    def process_exception(self, request, exception):
+        identitymap.end()
+
+
+class PlayerMiddleware(object):
+    '''
+    Sets request.player to the requesting Player, or None.  Goes after the
+    session, auth and identity map middleware.
+    '''
+    def process_request(self, request):
+        request.player = players.for_request(request)
+
+
+class InstrumentMiddleware(object):
+    '''
+    Per-request LazyJason counters (loads, freezes, lookups, saves,
+    NotAllowed raises), traced at INFO when the request is done.
+    '''
+    def process_request(self, request):
+        instrument.begin_request()
+
+    def process_response(self, request, response):
+        counts = instrument.end_request()
+        if counts and instrument.tracing(instrument.INFO):
+            instrument.trace(instrument.INFO, '%s %s %s', request.method,
+                             request.path, instrument.as_dict(counts))
+        return response
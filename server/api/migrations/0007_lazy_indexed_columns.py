@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def to_bool(val):
+    return bool(val)
+
+def to_id(val):
+    return None if val is None else int(val)
+
+def to_str(val):
+    return val
+
+# model -> [(lazy key, default, converter)]
+INDEXED = dict(
+    Game = [('started', False, to_bool)],
+    Charactor = [('activity', 'choosing_mission', to_str)],
+    Mission = [
+        ('active', False, to_bool),
+        ('hunter', None, to_id),
+        ('prey', None, to_id),
+    ],
+    Bounty = [('claimed', False, to_bool)],
+    Submission = [('dismissed', False, to_bool)],
+)
+
+
+def fill_indexed_columns(apps, schema_editor):
+    for model_name, keys in INDEXED.items():
+        model = apps.get_model('api', model_name)
+        rows = model.objects.values_list('id', 'db_attrs')
+        for pk, db_attrs in rows.iterator():
+            try:
+                jdict = jasoncodec.loads(db_attrs)
+            except ValueError:
+                jdict = {}
+            model.objects.filter(pk=pk).update(**dict(
+                ('ix_' + key, convert(jdict.get(key, default)))
+                for key, default, convert in keys
+            ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_invite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='ix_started',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='charactor',
+            name='ix_activity',
+            field=models.CharField(default=b'choosing_mission', max_length=64, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='mission',
+            name='ix_active',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='mission',
+            name='ix_hunter',
+            field=models.IntegerField(null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='mission',
+            name='ix_prey',
+            field=models.IntegerField(null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='bounty',
+            name='ix_claimed',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='ix_dismissed',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.RunPython(fill_indexed_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import api.lazyjason
+
+from api import jasoncodec
+
+LAZY_MODELS = ['Game', 'Player', 'MissionStunt', 'Event', 'Invite',
+               'Charactor', 'Mission', 'Bounty', 'Award', 'Submission']
+
+
+def is_postgres(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+def plain_json_rows(apps, schema_editor):
+    '''
+    jsonb can only hold plain JSON, so undo any compressing codec first
+    '''
+    if not is_postgres(schema_editor):
+        return
+    for model_name in LAZY_MODELS:
+        model = apps.get_model('api', model_name)
+        rows = model.objects.exclude(db_attrs__startswith='{')
+        for pk, db_attrs in rows.values_list('id', 'db_attrs').iterator():
+            try:
+                jdict = jasoncodec.loads(db_attrs)
+            except ValueError:
+                jdict = {}
+            model.objects.filter(pk=pk).update(
+                db_attrs=jasoncodec.CODECS['json'].dumps(jdict))
+
+
+def alter_to_jsonb(apps, schema_editor):
+    if not is_postgres(schema_editor):
+        return
+    for model_name in LAZY_MODELS:
+        table = apps.get_model('api', model_name)._meta.db_table
+        schema_editor.execute(
+            'ALTER TABLE %s ALTER COLUMN db_attrs TYPE jsonb '
+            'USING db_attrs::jsonb' % table)
+        schema_editor.execute(
+            'CREATE INDEX %s_db_attrs_gin ON %s '
+            'USING gin (db_attrs jsonb_path_ops)' % (table, table))
+
+
+def alter_to_varchar(apps, schema_editor):
+    if not is_postgres(schema_editor):
+        return
+    for model_name in LAZY_MODELS:
+        table = apps.get_model('api', model_name)._meta.db_table
+        schema_editor.execute('DROP INDEX IF EXISTS %s_db_attrs_gin' % table)
+        schema_editor.execute(
+            'ALTER TABLE %s ALTER COLUMN db_attrs TYPE varchar(102400) '
+            'USING db_attrs::text' % table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_lazy_indexed_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(plain_json_rows, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            # Django 1.8 can't ALTER ... TYPE jsonb without a USING clause,
+            # so the database side is done by hand.  sqlite doesn't care.
+            database_operations=[
+                migrations.RunPython(alter_to_jsonb, alter_to_varchar),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name=model_name.lower(),
+                    name='db_attrs',
+                    field=api.lazyjason.LazyJsonField(default=b'{}'),
+                )
+                for model_name in LAZY_MODELS
+            ],
+        ),
+    ]
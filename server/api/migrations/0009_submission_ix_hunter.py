@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def fill_submission_hunter(apps, schema_editor):
+    '''
+    Submissions used to only know their hunter through their Mission
+    '''
+    Mission = apps.get_model('api', 'Mission')
+    Submission = apps.get_model('api', 'Submission')
+    hunters = dict(Mission.objects.values_list('id', 'ix_hunter'))
+    rows = Submission.objects.values_list('id', 'db_attrs')
+    for pk, db_attrs in rows.iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        mission = jdict.get('mission')
+        hunter = hunters.get(int(mission)) if mission is not None else None
+        jdict['hunter'] = None if hunter is None else str(hunter)
+        Submission.objects.filter(pk=pk).update(
+            ix_hunter=hunter,
+            db_attrs=jasoncodec.CODECS['json'].dumps(jdict),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_db_attrs_jsonb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='ix_hunter',
+            field=models.IntegerField(null=True, db_index=True),
+        ),
+        migrations.RunPython(fill_submission_hunter, migrations.RunPython.noop),
+    ]
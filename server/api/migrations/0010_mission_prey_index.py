@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_submission_ix_hunter'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='mission',
+            index_together=set([('game', 'ix_prey', 'ix_active')]),
+        ),
+    ]
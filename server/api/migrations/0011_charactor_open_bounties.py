@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def fill_open_bounties(apps, schema_editor):
+    Bounty = apps.get_model('api', 'Bounty')
+    Charactor = apps.get_model('api', 'Charactor')
+    totals = {}
+    rows = Bounty.objects.filter(ix_claimed=False).values_list(
+        'target_id', 'db_attrs')
+    for target_id, db_attrs in rows.iterator():
+        try:
+            coin = jasoncodec.loads(db_attrs).get('coin', 0)
+        except ValueError:
+            coin = 0
+        count, total = totals.get(target_id, (0, 0))
+        totals[target_id] = (count + 1, total + coin)
+    for target_id, (count, total) in totals.items():
+        Charactor.objects.filter(pk=target_id).update(
+            open_bounty_count=count, open_bounty_coin=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_mission_prey_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='charactor',
+            name='open_bounty_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='charactor',
+            name='open_bounty_coin',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_open_bounties, migrations.RunPython.noop),
+    ]
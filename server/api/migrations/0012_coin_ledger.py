@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django_extensions.db.fields
+
+from api import jasoncodec
+
+
+def move_coin_to_ledger(apps, schema_editor):
+    '''
+    Charactor.coin used to live in db_attrs.  Move it to the column and
+    open every ledger with the balance it had.
+    '''
+    Charactor = apps.get_model('api', 'Charactor')
+    CoinTransaction = apps.get_model('api', 'CoinTransaction')
+    rows = Charactor.objects.values_list('id', 'db_attrs')
+    for pk, db_attrs in rows.iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        if 'coin' not in jdict:
+            continue
+        coin = int(jdict.pop('coin') or 0)
+        Charactor.objects.filter(pk=pk).update(
+            coin=coin, db_attrs=jasoncodec.CODECS['json'].dumps(jdict))
+        if coin:
+            CoinTransaction.objects.create(
+                charactor_id=pk, amount=coin, reason='opening_balance')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_charactor_open_bounties'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoinTransaction',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('_created', django_extensions.db.fields.CreationDateTimeField(default=django.utils.timezone.now, editable=False, blank=True)),
+                ('amount', models.IntegerField()),
+                ('reason', models.CharField(max_length=64)),
+                ('related_type', models.CharField(max_length=64, blank=True)),
+                ('related_id', models.IntegerField(null=True)),
+                ('charactor', models.ForeignKey(to='api.Charactor')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='charactor',
+            name='coin',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(move_coin_to_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def fill_mission_state(apps, schema_editor):
+    '''
+    Missions that were ever accepted are active or have a Submission; the
+    rest are offers.  Old offers are left for sweep_mission_offers.
+    '''
+    Mission = apps.get_model('api', 'Mission')
+    Submission = apps.get_model('api', 'Submission')
+    submitted = set()
+    for db_attrs in Submission.objects.values_list('db_attrs', flat=True).iterator():
+        try:
+            mission = jasoncodec.loads(db_attrs).get('mission')
+        except ValueError:
+            continue
+        if mission is not None:
+            submitted.add(int(mission))
+    rows = Mission.objects.values_list('id', 'ix_active', 'db_attrs')
+    for pk, active, db_attrs in rows.iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        state = 'accepted' if active or pk in submitted else 'offered'
+        jdict['state'] = state
+        Mission.objects.filter(pk=pk).update(
+            ix_state=state, db_attrs=jasoncodec.CODECS['json'].dumps(jdict))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_coin_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mission',
+            name='ix_state',
+            field=models.CharField(default=b'offered', max_length=16, db_index=True),
+        ),
+        migrations.RunPython(fill_mission_state, migrations.RunPython.noop),
+    ]
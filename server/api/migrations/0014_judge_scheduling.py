@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def fill_judging_columns(apps, schema_editor):
+    Charactor = apps.get_model('api', 'Charactor')
+    Submission = apps.get_model('api', 'Submission')
+    for pk, db_attrs in Charactor.objects.values_list('id', 'db_attrs').iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        depth = len(jdict.get('current_judge_submissions') or [])
+        if depth:
+            Charactor.objects.filter(pk=pk).update(judge_queue_depth=depth)
+    for pk, db_attrs in Submission.objects.values_list('id', 'db_attrs').iterator():
+        try:
+            judgement = jasoncodec.loads(db_attrs).get('judgement')
+        except ValueError:
+            continue
+        if judgement is not None:
+            Submission.objects.filter(pk=pk).update(ix_judgement=bool(judgement))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_mission_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='charactor',
+            name='judge_latency',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='charactor',
+            name='judge_queue_depth',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='ix_judgement',
+            field=models.NullBooleanField(db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('game', 'ix_judgement', 'ix_dismissed')]),
+        ),
+        migrations.RunPython(fill_judging_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_judge_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('_created', django_extensions.db.fields.CreationDateTimeField(default=django.utils.timezone.now, editable=False, blank=True)),
+                ('kind', models.CharField(max_length=32)),
+                ('text', models.CharField(max_length=256, blank=True)),
+                ('related_type', models.CharField(max_length=64, blank=True)),
+                ('related_id', models.IntegerField(null=True)),
+                ('charactor', models.ForeignKey(to='api.Charactor')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='notification',
+            index_together=set([('charactor', 'id')]),
+        ),
+        migrations.AddField(
+            model_name='charactor',
+            name='notification_cursor',
+            field=models.IntegerField(default=0),
+        ),
+    ]
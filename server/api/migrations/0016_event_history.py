@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django_extensions.db.fields
+
+from api import history
+from api import jasoncodec
+
+
+def fill_event_name(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    for pk, db_attrs in Event.objects.values_list('id', 'db_attrs').iterator():
+        try:
+            name = jasoncodec.loads(db_attrs).get('name')
+        except ValueError:
+            continue
+        if name:
+            Event.objects.filter(pk=pk).update(ix_name=name[:32])
+
+
+def seed_baselines(apps, schema_editor):
+    '''
+    Games already going have no events, so replays of them start from a
+    snapshot of their rows as they are now
+    '''
+    Game = apps.get_model('api', 'Game')
+    GameSnapshot = apps.get_model('api', 'GameSnapshot')
+    dumps = jasoncodec.CODECS['json'].dumps
+    for game_id in Game.objects.values_list('id', flat=True).iterator():
+        GameSnapshot.objects.create(
+            game_id=game_id, event_id=0,
+            state=dumps(history.baseline(apps, game_id)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('_created', django_extensions.db.fields.CreationDateTimeField(default=django.utils.timezone.now, editable=False, blank=True)),
+                ('event_id', models.IntegerField()),
+                ('state', models.TextField()),
+                ('game', models.ForeignKey(to='api.Game')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='gamesnapshot',
+            index_together=set([('game', 'event_id')]),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='ix_name',
+            field=models.CharField(default=b'generic event', max_length=32, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='event',
+            index_together=set([('game', 'id')]),
+        ),
+        migrations.RunPython(fill_event_name, migrations.RunPython.noop),
+        migrations.RunPython(seed_baselines, migrations.RunPython.noop),
+    ]
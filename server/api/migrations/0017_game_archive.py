@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_event_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='ix_over',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('_created', django_extensions.db.fields.CreationDateTimeField(default=django.utils.timezone.now, editable=False, blank=True)),
+                ('event_id', models.IntegerField(null=True)),
+                ('summary', models.TextField()),
+                ('compacted', models.BooleanField(default=False, db_index=True)),
+                ('game', models.OneToOneField(to='api.Game')),
+            ],
+        ),
+    ]
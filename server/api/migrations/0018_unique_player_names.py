@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def repoint(model, keys, merged):
+    '''
+    Point the Player ids kept in db_attrs under keys at the merged Player
+    '''
+    dumps = jasoncodec.CODECS['json'].dumps
+    for pk, db_attrs in model.objects.values_list('id', 'db_attrs').iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        changed = False
+        for key in keys:
+            if jdict.get(key) in merged:
+                jdict[key] = merged[jdict[key]]
+                changed = True
+        if changed:
+            model.objects.filter(pk=pk).update(db_attrs=dumps(jdict))
+
+
+def merge_duplicate_players(apps, schema_editor):
+    '''
+    Every unique_name is kept by its oldest Player.  The newer ones hand
+    over their Charactors, Invites, Games and PlayerConnectors, and their
+    alias if the oldest has none, and are deleted.
+    '''
+    Player = apps.get_model('api', 'Player')
+    Charactor = apps.get_model('api', 'Charactor')
+    Invite = apps.get_model('api', 'Invite')
+    Game = apps.get_model('api', 'Game')
+    PlayerConnector = apps.get_model('djuser', 'PlayerConnector')
+    dumps = jasoncodec.CODECS['json'].dumps
+
+    dups = Player.objects.values('unique_name').annotate(
+        n=models.Count('id')).filter(n__gt=1)
+    # {str(old id): str(kept id)}
+    merged = {}
+    for row in dups:
+        players = list(Player.objects.filter(
+            unique_name=row['unique_name']).order_by('id'))
+        keep, rest = players[0], players[1:]
+        try:
+            kept = jasoncodec.loads(keep.db_attrs)
+        except ValueError:
+            kept = {}
+        for p in rest:
+            try:
+                jdict = jasoncodec.loads(p.db_attrs)
+            except ValueError:
+                continue
+            if not kept.get('alias') and jdict.get('alias'):
+                kept['alias'] = jdict['alias']
+        Player.objects.filter(pk=keep.pk).update(db_attrs=dumps(kept))
+        rest_ids = [p.id for p in rest]
+        Charactor.objects.filter(player__in=rest_ids).update(player=keep.id)
+        PlayerConnector.objects.filter(
+            player_id__in=[str(i) for i in rest_ids]).update(
+            player_id=str(keep.id))
+        for i in rest_ids:
+            merged[str(i)] = str(keep.id)
+    if not merged:
+        return
+    repoint(Invite, ('created_by', 'created_for'), merged)
+    repoint(Game, ('creator',), merged)
+    Player.objects.filter(id__in=[int(i) for i in merged]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_game_archive'),
+        ('djuser', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_players, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='player',
+            name='unique_name',
+            field=models.CharField(unique=True, max_length=1024),
+        ),
+        migrations.AlterIndexTogether(
+            name='game',
+            index_together=set([('name', 'ix_started')]),
+        ),
+    ]
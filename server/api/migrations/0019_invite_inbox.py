@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from api import jasoncodec
+
+
+def fill_invite_columns(apps, schema_editor):
+    Invite = apps.get_model('api', 'Invite')
+    for pk, db_attrs in Invite.objects.values_list('id', 'db_attrs').iterator():
+        try:
+            jdict = jasoncodec.loads(db_attrs)
+        except ValueError:
+            continue
+        try:
+            created_for = int(jdict.get('created_for'))
+        except (TypeError, ValueError):
+            created_for = None
+        Invite.objects.filter(pk=pk).update(
+            ix_created_for=created_for, ix_state=jdict.get('state', 'null'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_unique_player_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invite',
+            name='ix_created_for',
+            field=models.IntegerField(null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='invite',
+            name='ix_state',
+            field=models.CharField(default=b'null', max_length=16, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='invite',
+            index_together=set([('ix_created_for', 'ix_state', 'id')]),
+        ),
+        migrations.RunPython(fill_invite_columns, migrations.RunPython.noop),
+    ]
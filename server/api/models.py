@@ -1,22 +1,43 @@
 #! /usr/bin/env python2.7
 
 import json
+import time
 import random
 import datetime
 import functools
+import collections
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone
 from django_extensions.db.fields import CreationDateTimeField
-from django.db.models.signals import post_init, pre_save, post_save
 
-from api.lazyjason import LazyJason, post_init_for_lazies, pre_save_for_lazies, post_save_for_lazies
+from api.lazyjason import Lazy, LazyJasonModel, prefetch_lazy_objects
+from api import history
+from api import identitymap
+from api import instrument
+from api import jasoncodec
+from api import players
+from api import judging
+from api import stunts
+from api.instrument import trace, INFO
 
 def younger_than_one_day_ago(model_obj):
     #age = datetime.datetime.now(timezone.utc) - model_obj._created
     age = datetime.datetime.now() - model_obj._created
     return age < datetime.timedelta(days=1)
 
+# Most Players one invite can take
+MAX_INVITES = 100
+
+# Notification texts
+AS_PREY = 'Someone has sent in a photo of you'
+AS_JUDGE = 'A photo is waiting for your judgement'
+JUDGED = 'A photo you were part of has been judged'
+SUBMISSION_FINISHED = 'Your photo has been judged'
+BOUNTY_NEW = 'A bounty was added to your mission'
+BOUNTY_CLAIMED = 'One or more of the bounties you are hunting was claimed'
+TIP_CHANGE = 'The tips on a photo you are part of changed'
+
 class NotAllowed(Exception):
     def __nonzero__(self):
         return False
@@ -33,9 +54,11 @@ def allower(fn):
         try:
             result = fn(*args, **kwargs)
         except NotAllowed as e:
-            print 'Not Allowed: ', e
+            owner = args[0] if args else None
+            model = getattr(owner, '__name__', type(owner).__name__)
+            instrument.count('not_allowed', model)
+            trace(INFO, 'Not Allowed: %s', e)
             if fail != RAISE:
-                print e
                 fn.__allower_result = e
                 return fail
             else:
@@ -46,35 +69,66 @@ def allower(fn):
             return True
     return wrapper
 
-class Game(models.Model, LazyJason):
+class Game(LazyJasonModel):
     name = models.CharField(max_length=1024)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_started = models.BooleanField(default=False, db_index=True)
+    ix_over = models.BooleanField(default=False, db_index=True)
     _lazy_defaults = dict(
         creator = None,
         started = False,
+        over = False,
     )
+    _lazy_indexed = ('started', 'over')
+
+    class Meta:
+        # create_new_game_allowed: is there an unstarted game with this name
+        index_together = [('name', 'ix_started')]
 
     def __unicode__(self):
         return self.name
 
     @property
     def players(self):
-        return [c.player for c in self.charactor_set.all()]
+        return [c.player for c in self.charactor_set.select_related('player')]
+
+    def has_player(self, player):
+        return self.charactor_set.filter(player=player.id).exists()
 
     def new_charactor(self, player):
         c = Charactor(game=self, player=player)
         c.save()
+        return c
 
     def to_dict(self):
         return super(Game, self).to_dict('name')
 
     def game_over(self):
-        #TODO: clean up all cruft like old missions, etc
-        #      ideally only Event objects will remain
-        pass
+        '''
+        Ends the game.  manage.py archive_games later clears its rows out
+        of the live tables, see api.archive.
+        '''
+        with transaction.atomic():
+            Mission.expire(list(self.mission_set.filter(ix_state='offered')))
+            self.over = True
+            self.save()
+            history.record(self, 'game_over')
+            history.snapshot(self.id)
 
     # API ----------------------------------------------
 
+    def end(self, requestor):
+        self.end_allowed(requestor)
+        self.game_over()
+
+    @allower
+    def end_allowed(self, requestor):
+        if str(self.creator) != str(requestor.id):
+            raise NotAllowed('end not allowed - only the creator may end it')
+        if not self.started:
+            raise NotAllowed('end not allowed - game has not started')
+        if self.over:
+            raise NotAllowed('end not allowed - game is already over')
+
     @classmethod
     def create_new_game(cls, name, creator):
         cls.create_new_game_allowed(name, creator)
@@ -91,21 +145,56 @@ class Game(models.Model, LazyJason):
 
         # you can have duplicate names, so long as any dups have already
         # started.
-        results = cls.objects.filter(name=name)
-        for r in results:
-            if not r.started:
-                raise NotAllowed('create_new_game not allowed - another game with the same name is waiting to start')
+        if cls.objects.filter(name=name, ix_started=False).exists():
+            raise NotAllowed('create_new_game not allowed - another game with the same name is waiting to start')
 
     def start(self, requestor):
-        self.start_allowed(requestor)
-
-        self.started = True
-        for c in self.charactor_set.all():
-            c.on_game_start(self)
-        self.save()
+        '''
+        Everything is worked out in memory first and then written in a fixed
+        number of queries, all in one transaction, whatever the size of the
+        game.
+        '''
+        with transaction.atomic():
+            # Checked on the locked row, so two starts at once can't both
+            # get past it and make every offer twice
+            Game.objects.select_for_update().get(
+                pk=self.pk).start_allowed(requestor)
+            charactors = list(self.charactor_set.select_related('player'))
+            offers = []
+            for c in charactors:
+                if c.c_name == c._lazy_defaults['c_name']:
+                    c.c_name = 'C-' + c.player.unique_name
+                offers += c.build_potential_missions(charactors)
+
+            last = Mission.objects.filter(game=self).aggregate(
+                last=models.Max('id'))['last'] or 0
+            for m in offers:
+                m.freeze_db_attrs()
+            Mission.objects.bulk_create(offers)
+            # bulk_create doesn't hand back ids, but hunter -> prey is unique
+            # among the new offers
+            created = {}
+            for m in Mission.objects.filter(game=self, id__gt=last):
+                created[(m.ix_hunter, m.ix_prey)] = identitymap.add(m)
+            for c in charactors:
+                c.potential_missions = [
+                    created[(int(m.hunter), int(m.prey))].id
+                    for m in offers if m.hunter == str(c.id)
+                ]
+
+            # Everyone starts on 100
+            CoinTransaction.record_many(
+                [(c, 100 - c.coin) for c in charactors], 'game_start', self)
+            Charactor.bulk_save(charactors)
+            self.started = True
+            self.save()
+            history.record(self, 'game_start', coin=100, charactors=dict(
+                (str(c.id), c.c_name) for c in charactors))
 
     @allower
     def start_allowed(self, requestor):
+        if self.started:
+            raise NotAllowed('start not allowed - game already started')
         g_chars = self.charactor_set.all()
         if len(g_chars) < 6:
             raise NotAllowed('start not allowed - need more charactors')
@@ -114,31 +203,101 @@ class Game(models.Model, LazyJason):
             raise NotAllowed('start not allowed - you are not in this game')
 
     def invite(self, requestor, unique_id, name=''):
-        self.invite_allowed(requestor, unique_id, name)
-
-        try:
-            p = Player.objects.get(unique_name=unique_id)
-        except Player.DoesNotExist:
-            p = Player(unique_name=unique_id)
-        p.alias = name
-        p.save()
-
-        i = Invite(game=self)
-        i.created_by = str(requestor.id)
-        i.created_for = str(p.id)
-        i.state = 'queued'
-        i.save()
+        return self.invite_many(requestor, [(unique_id, name)])
 
-        self.save()
+    def invite_many(self, requestor, invitees):
+        '''
+        Invite every (unique_id, name) in invitees, creating the Players
+        that don't exist yet.  Takes the same handful of queries however
+        many there are.  A name, if given, becomes the Player's alias.
+        Returns the invited Players.
+        '''
+        # In the order asked for
+        names = collections.OrderedDict()
+        for unique_id, name in invitees:
+            if name or unique_id not in names:
+                names[unique_id] = name
+        self.invite_allowed(requestor, names)
+
+        with transaction.atomic():
+            found = {}
+            for p in Player.objects.filter(
+                    unique_name__in=list(names)).order_by('-id'):
+                found[p.unique_name] = p
+            renamed = []
+            for unique_id, p in found.items():
+                if names[unique_id] and p.alias != names[unique_id]:
+                    p.alias = names[unique_id]
+                    renamed.append(p)
+            Player.bulk_save(renamed)
+            for p in renamed:
+                players.invalidate(p.id)
+
+            new = []
+            for unique_id in names:
+                if unique_id not in found:
+                    p = Player(unique_name=unique_id)
+                    p.alias = names[unique_id]
+                    p.freeze_db_attrs()
+                    new.append(p)
+            if new:
+                try:
+                    with transaction.atomic():
+                        Player.objects.bulk_create(new)
+                except IntegrityError:
+                    # a concurrent invite created some of them first
+                    for p in new:
+                        try:
+                            with transaction.atomic():
+                                p.save()
+                        except IntegrityError:
+                            pass
+                # bulk_create doesn't hand back ids
+                for p in Player.objects.filter(
+                        unique_name__in=[n.unique_name for n in new]):
+                    found[p.unique_name] = p
+
+            invited = [found[unique_id] for unique_id in names]
+            last = Invite.objects.filter(game=self).aggregate(
+                last=models.Max('id'))['last'] or 0
+            invites = []
+            for p in invited:
+                i = Invite(game=self)
+                i.created_by = str(requestor.id)
+                i.created_for = str(p.id)
+                i.state = 'queued'
+                i.freeze_db_attrs()
+                invites.append(i)
+            Invite.objects.bulk_create(invites)
+            history.record(self, 'invite', by=str(requestor.id), invites=dict(
+                (str(i.id), i.created_for) for i in
+                Invite.objects.filter(game=self, id__gt=last)))
+        return invited
 
     @allower
-    def invite_allowed(self, requestor, unique_id, name):
-        if requestor not in self.players:
+    def invite_allowed(self, requestor, invitees):
+        if not invitees:
+            raise NotAllowed('invite not allowed - nobody to invite')
+        if len(invitees) > MAX_INVITES:
+            raise NotAllowed('invite not allowed - more than %d invitees'
+                             % MAX_INVITES)
+        if not self.has_player(requestor):
             raise NotAllowed('invite not allowed - player not in this game')
 
-class Player(models.Model, LazyJason):
-    unique_name = models.CharField(max_length=1024)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    def history(self, requestor, upto=None):
+        '''
+        The game's state as of event id upto, or now.  See api.history.
+        '''
+        self.history_allowed(requestor)
+        return history.state_at(self.id, upto)
+
+    @allower
+    def history_allowed(self, requestor):
+        if not self.has_player(requestor):
+            raise NotAllowed('history not allowed - player not in this game')
+
+class Player(LazyJasonModel):
+    unique_name = models.CharField(max_length=1024, unique=True)
     _lazy_defaults = dict(
         alias='',
         last_auth_token=None,
@@ -148,6 +307,15 @@ class Player(models.Model, LazyJason):
     def __unicode__(self):
         return self.unique_name
 
+    def save(self, *args, **kwargs):
+        super(Player, self).save(*args, **kwargs)
+        players.invalidate(self.pk)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        super(Player, self).delete(*args, **kwargs)
+        players.invalidate(pk)
+
     def authorize_new_session(self, token):
         if self.last_auth_token == None:
             return False
@@ -163,53 +331,224 @@ class Player(models.Model, LazyJason):
         self.save()
 
 
-class MissionStunt(models.Model, LazyJason):
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
-    _lazy_defaults = {'text':''}
+class MissionStunt(LazyJasonModel):
+    # weight is how often the stunt comes up relative to the others, 0 for
+    # never
+    _lazy_defaults = {'text':'', 'weight':1.0}
 
     def __unicode__(self):
         if hasattr(self, 'text'):
             return self.text
         return 'NEW MISSION STUNT'
 
+    def save(self, *args, **kwargs):
+        super(MissionStunt, self).save(*args, **kwargs)
+        stunts.invalidate()
+
+    def delete(self, *args, **kwargs):
+        super(MissionStunt, self).delete(*args, **kwargs)
+        stunts.invalidate()
+
+    @classmethod
+    def cached_by_id(cls, objid):
+        return stunts.get(objid)
+
 
 # -----------------------------------------------------------------------------
 # Game - dependent models
 
-class Event(models.Model, LazyJason):
+class Event(LazyJasonModel):
+    '''
+    One entry in a game's history, see api.history
+    '''
     _created = CreationDateTimeField()
     game = models.ForeignKey(Game)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_name = models.CharField(default='generic event', max_length=32,
+                               db_index=True)
     _lazy_defaults = dict(
         name = 'generic event',
+        # Who did it, if it was a Charactor
+        charactor = Lazy(ref='Charactor'),
+        data = {},
     )
+    _lazy_indexed = ('name',)
+
+    class Meta:
+        index_together = [('game', 'id')]
+
+    def __unicode__(self):
+        return "%s %s %s" % (self.id, self.name, self.charactor)
 
 
-class Invite(models.Model, LazyJason):
+class GameSnapshot(models.Model):
+    '''
+    A game's api.history state as of event_id, so it can be rebuilt without
+    replaying everything before it
+    '''
     _created = CreationDateTimeField()
     game = models.ForeignKey(Game)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    event_id = models.IntegerField()
+    # api.history state, encoded with the LazyJason codec
+    state = models.TextField()
+
+    class Meta:
+        index_together = [('game', 'event_id')]
+
+    def __unicode__(self):
+        return "%s @ %s" % (self.game_id, self.event_id)
+
+    def get_state(self):
+        return jasoncodec.loads(self.state)
+
+
+class GameArchive(models.Model):
+    '''
+    What is left of a finished game once api.archive has cleared it out
+    '''
+    _created = CreationDateTimeField()
+    game = models.OneToOneField(Game)
+    # The last Event in the archived state
+    event_id = models.IntegerField(null=True)
+    # {'state': api.history state, 'ledger': {charactor: {reason: total}}}
+    # encoded with the LazyJason codec
+    summary = models.TextField()
+    # Set once all the game's derived rows are gone
+    compacted = models.BooleanField(default=False, db_index=True)
+
+    def __unicode__(self):
+        return "%s (%s)" % (self.game_id,
+                            'compacted' if self.compacted else 'archiving')
+
+    def get_summary(self):
+        return jasoncodec.loads(self.summary)
+
+
+class Invite(LazyJasonModel):
+    _created = CreationDateTimeField()
+    game = models.ForeignKey(Game)
+    ix_created_for = models.IntegerField(null=True, db_index=True)
+    ix_state = models.CharField(default='null', max_length=16, db_index=True)
     _lazy_defaults = dict(
         name = 'Invite',
-        created_by = None,
-        created_for = None,
+        created_by = Lazy(ref='Player'),
+        created_for = Lazy(ref='Player'),
+        # queued -> accepted, or queued -> declined
         state = 'null',
     )
+    _lazy_indexed = ('created_for', 'state')
+
+    class Meta:
+        # pending_for: a player's queued invites, a page at a time
+        index_together = [('ix_created_for', 'ix_state', 'id')]
+
+    def __unicode__(self):
+        return "%s for %s (%s)" % (self.game_id, self.created_for, self.state)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            game=self.game_id,
+            game_name=self.game.name,
+            created_by=self.created_by,
+            state=self.state,
+            created=self._created.isoformat(),
+        )
+
+    @classmethod
+    def pending_for(cls, player, after=None, limit=20):
+        '''
+        A page of player's queued invites after the id given, oldest first
+        '''
+        invites = cls.objects.filter(
+            ix_created_for=player.id, ix_state='queued')
+        if after is not None:
+            invites = invites.filter(id__gt=after)
+        return list(invites.select_related('game').order_by('id')[:limit])
 
+    def respond(self, state):
+        '''
+        Move a queued invite to state.  Returns False if it had already
+        been answered.
+        '''
+        with transaction.atomic():
+            if not Invite.objects.filter(
+                    pk=self.pk, ix_state='queued').update(ix_state=state):
+                return False
+            self.state = state
+            self.save()
+        return True
+
+    # API ----------------------------------------------
+
+    def accept(self, requestor):
+        '''
+        Join the game.  Returns the new Charactor, or None if the invite
+        had already been answered.
+        '''
+        self.accept_allowed(requestor)
+        with transaction.atomic():
+            if not self.respond('accepted'):
+                return None
+            history.record(self.game_id, 'invite_answer',
+                           invite=str(self.id), state='accepted')
+            if self.game.has_player(requestor):
+                return None
+            return self.game.new_charactor(requestor)
 
-class Charactor(models.Model, LazyJason):
+    @allower
+    def accept_allowed(self, requestor):
+        if self.created_for != str(requestor.id):
+            raise NotAllowed('not allowed - invite is for another player')
+        if self.state != 'queued':
+            raise NotAllowed('not allowed - invite already answered')
+        if self.game.started:
+            raise NotAllowed('accept not allowed - game has started')
+
+    def decline(self, requestor):
+        self.decline_allowed(requestor)
+        if self.respond('declined'):
+            history.record(self.game_id, 'invite_answer',
+                           invite=str(self.id), state='declined')
+
+    @allower
+    def decline_allowed(self, requestor):
+        if self.created_for != str(requestor.id):
+            raise NotAllowed('not allowed - invite is for another player')
+        if self.state != 'queued':
+            raise NotAllowed('not allowed - invite already answered')
+
+
+class Charactor(LazyJasonModel):
     game = models.ForeignKey(Game)
     player = models.ForeignKey(Player)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_activity = models.CharField(default='choosing_mission', max_length=64,
+                                   db_index=True)
+    # Balance of the Charactor's CoinTransactions
+    coin = models.IntegerField(default=0)
+    # Unclaimed bounties on this Charactor, kept up to date by Bounty
+    open_bounty_count = models.IntegerField(default=0)
+    open_bounty_coin = models.IntegerField(default=0)
+    # For api.judging: submissions waiting on this Charactor's judgement, and
+    # a moving average of how many seconds it takes to give one
+    judge_queue_depth = models.IntegerField(default=0)
+    judge_latency = models.FloatField(default=0.0)
+    # Id of the last Notification read
+    notification_cursor = models.IntegerField(default=0)
     _lazy_defaults = dict(
         c_name = 'C-?',
-        coin = 0,
         activity = 'choosing_mission',
-        potential_missions = [],
-        notifications = [],
-        current_prey_submissions = [],
-        current_judge_submissions = [],
+        potential_missions = Lazy([], ref='Mission'),
+        # Work queues, not notifications: the submissions waiting on this
+        # Charactor right now.  Each is taken off again when it is judged,
+        # so they only ever hold open submissions.  Messages go to the
+        # Notification table.
+        current_prey_submissions = Lazy([], ref='Submission'),
+        current_judge_submissions = Lazy([], ref='Submission'),
     )
+    _lazy_indexed = ('activity',)
+    _sql_maintained = ('coin', 'open_bounty_count', 'open_bounty_coin',
+                       'judge_queue_depth', 'judge_latency',
+                       'notification_cursor')
 
     def __unicode__(self):
         return self.name
@@ -222,10 +561,9 @@ class Charactor(models.Model, LazyJason):
 
     @property
     def submission(self):
-        result = [
-            s for s in self.game.submission_set.all()
-            if (s.dismissed == False and s.stakeholders['hunter'] == self)
-        ]
+        result = list(Submission.objects.filter(
+            ix_hunter=self.id, ix_dismissed=False,
+        ))
         if result:
             assert len(result) == 1
             return result[0]
@@ -238,10 +576,9 @@ class Charactor(models.Model, LazyJason):
         the .mission attribute will be None, so access the finished mission
         via the .submission property.
         '''
-        result = [
-            m for m in self.game.mission_set.all()
-            if (m.active == True and m.hunter == str(self.id))
-        ]
+        result = list(Mission.objects.filter(
+            game=self.game_id, ix_active=True, ix_hunter=self.id,
+        ))
         if result:
             assert len(result) == 1
             return result[0]
@@ -255,60 +592,73 @@ class Charactor(models.Model, LazyJason):
 
     @property
     def current_bounties(self):
-        bounties = Bounty.objects.filter(target=self.id)
-        bounties = [b for b in bounties if not b.claimed]
-        return bounties
-
-    def on_game_start(self, game):
-        self.coin = 100
-        if self.c_name == self._lazy_defaults['c_name']:
-            self.c_name = 'C-'+ self.player.unique_name
-        self.get_potential_missions(self_save=False)
-        self.save()
+        return list(Bounty.objects.filter(target=self.id, ix_claimed=False))
 
-    def add_coin(self, amount):
-        self.coin = self.coin + amount
-        self.save()
+    def to_dict(self, *extra_args):
+        return super(Charactor, self).to_dict('coin', *extra_args)
 
-    def remove_coin(self, amount):
-        self.coin = self.coin - amount
-        self.save()
+    def add_coin(self, amount, reason, related=None):
+        CoinTransaction.record(self, amount, reason, related)
+
+    def remove_coin(self, amount, reason, related=None):
+        if not CoinTransaction.record(self, -amount, reason, related,
+                                      overdraw=False):
+            raise NotAllowed('not allowed - char does not have the coin')
 
     def get_potential_missions(self, self_save=True):
-        if hasattr(self, 'potential_missions'):
-            missions = self.potential_missions_Mission__objects
-            print missions
-            if missions and all(younger_than_one_day_ago(x) for x in missions):
-                return missions
-            # Old ones will garbage-collect on game_over
+        '''
+        The open mission offers, replaced by new ones once they are a day
+        old.  The answer is remembered on the instance, and the identity
+        map hands the same instance around a request, so asking again
+        doesn't mint more Missions.
+        '''
+        memo = self.__dict__.get('_offers')
+        if memo is not None and memo[0] == self.potential_missions:
+            return memo[1]
+
+        missions = self.potential_missions_Mission__objects
+        if missions and all(m.is_open_offer() for m in missions):
+            prefetch_lazy_objects(missions, 'prey_Charactor')
+        else:
+            Mission.expire([m for m in missions if m.state == 'offered'])
+            missions = self.build_potential_missions()
+            for m in missions:
+                m.save()
+            self.potential_missions = missions
+            if self_save:
+                self.save()
+
+        self._offers = (list(self.potential_missions), missions)
+        return missions
 
+    def build_potential_missions(self, charactors=None):
+        '''
+        New, unsaved, Mission offers.  charactors can be passed in when they
+        are already loaded.
+        '''
         missions = []
         stunt = self.choose_stunt()
-        for prey in self.choose_potential_prey():
-            m = Mission(game = self.game)
+        for prey in self.choose_potential_prey(charactors):
+            m = Mission(game_id=self.game_id)
             m.lazy_set(
                 stunt = str(stunt.id),
                 hunter = str(self.id),
                 prey = str(prey.id),
                 award = self.current_award,
             )
-            m.save()
             missions.append(m)
-        self.potential_missions = [str(x.id) for x in missions]
-        if self_save:
-            self.save()
-
         return missions
 
-    def choose_potential_prey(self):
+    def choose_potential_prey(self, charactors=None):
         # TODO: make this smarter
-        allcs = set(self.game.charactor_set.all())
+        if charactors is None:
+            charactors = self.game.charactor_set.all()
+        allcs = set(charactors)
         allcs.remove(self)
         return [allcs.pop(), allcs.pop()]
 
     def choose_stunt(self):
-        # TODO: make this smarter
-        return random.choice(MissionStunt.objects.all())
+        return stunts.sample()
 
     def human_readable_mission(self):
         return self.mission.human_readable()
@@ -320,7 +670,9 @@ class Charactor(models.Model, LazyJason):
         self.save()
 
     def notify_prey_finished(self, submission):
-        self.current_prey_submissions.remove(str(submission.id))
+        self.lazy_set(current_prey_submissions=[
+            x for x in self.current_prey_submissions if x != str(submission.id)
+        ])
         self.save()
 
     def notify_as_judge(self, submission):
@@ -328,26 +680,82 @@ class Charactor(models.Model, LazyJason):
             self.current_judge_submissions + [str(submission.id)]
         )
         self.save()
+        Charactor.add_to_columns(self.pk, instance=self, judge_queue_depth=1)
 
     def notify_judge_finished(self, submission):
-        self.current_judge_submissions.remove(str(submission.id))
+        if str(submission.id) not in self.current_judge_submissions:
+            return
+        self.lazy_set(current_judge_submissions=[
+            x for x in self.current_judge_submissions if x != str(submission.id)
+        ])
         self.save()
+        Charactor.add_to_columns(self.pk, instance=self, judge_queue_depth=-1)
 
-    def notify_bounty_claimed(self):
-        msg = 'One or more of the bounties you are hunting was claimed'
-        print self, msg
-        # TODO
+    def take_judging(self, requestor):
+        '''
+        The oldest submission in the game still waiting for a judgement
+        that this Charactor may judge.  They become one of its judges if
+        they weren't already.  None if there is nothing to judge.
+        '''
+        self.take_judging_allowed(requestor)
+        for s in Submission.judging_queue(self.game_id):
+            peeps = s.stakeholders
+            if self in (peeps['hunter'], peeps['prey']):
+                continue
+            if str(self.id) in s.judges:
+                return s
+            with transaction.atomic():
+                # judges is a json list: lock the row so two judges taking
+                # it at once can't lose an append
+                s = Submission.objects.select_for_update().get(pk=s.pk)
+                if s.judgement is not None:
+                    continue
+                if str(self.id) not in s.judges:
+                    s.judges = s.judges + [self.id]
+                    s.save()
+                    self.notify_as_judge(s)
+                    history.record(self.game_id, 'take_judging', self,
+                                   submission=str(s.id))
+            return s
+        return None
+
+    @allower
+    def take_judging_allowed(self, requestor):
+        if requestor.id != self.player_id:
+            raise NotAllowed('not allowed - player does not own char')
+
+    def notify(self, kind, text='', related=None):
+        Notification.fan_out([self], kind, text, related)
+
+    def notify_tip_change(self, submission):
+        self.notify('tip_change', TIP_CHANGE, submission)
+
+    def unread_notifications(self, requestor, after=None, limit=20):
+        self.notifications_allowed(requestor)
+        return Notification.unread(self, after, limit)
+
+    def read_notifications(self, requestor, upto):
+        '''
+        Move the read cursor up to the Notification id upto.  It never
+        moves back.
+        '''
+        self.notifications_allowed(requestor)
+        Charactor.objects.filter(
+            pk=self.pk, notification_cursor__lt=upto,
+        ).update(notification_cursor=upto)
+        self.notification_cursor = max(self.notification_cursor, upto)
 
-    def notify_bounty_new(self, bounty):
-        msg = 'A bounty was added to your mission'
-        print self, msg
-        # TODO
+    @allower
+    def notifications_allowed(self, requestor):
+        if requestor.id != self.player_id:
+            raise NotAllowed('not allowed - player does not own char')
 
     def submission_finished(self, submission):
         self.activity = 'submission_finished'
         if submission.judgement == True:
-            self.coin = self.coin + submission.hunter_pay
+            self.add_coin(submission.hunter_pay, 'hunter_pay', submission)
         self.save()
+        self.notify('submission_finished', SUBMISSION_FINISHED, submission)
 
     def submission_dismissed(self, submission):
         if submission.judgement == True:
@@ -360,18 +768,21 @@ class Charactor(models.Model, LazyJason):
     # API ----------------------------------------------
 
     def accept_mission(self, requestor, mission):
-        print 'mission', mission
-        print 'p ms', self.get_potential_missions(self_save=False)
         self.accept_allowed(requestor, mission)
         mission.accept()
+        Mission.expire([m for m in self.get_potential_missions(self_save=False)
+                        if m != mission])
 
         self.activity = 'hunting'
         self.potential_missions = []
         self.save()
+        history.record(self.game_id, 'mission_accept', self,
+                       mission=str(mission.id), prey=mission.prey,
+                       stunt=mission.stunt)
 
     @allower
     def accept_allowed(self, requestor, mission):
-        if requestor != self.player:
+        if requestor.id != self.player_id:
             raise NotAllowed('accept not allowed - player does not own char')
         if self.activity != 'choosing_mission':
             raise NotAllowed('accept not allowed - not choosing_mission')
@@ -382,92 +793,159 @@ class Charactor(models.Model, LazyJason):
         self.submit_allowed(requestor, photo_url)
 
         s = Submission(game = self.game)
-        s.mission = str(self.mission.id)
+        s.mission = self.mission
+        s.hunter = self
         s.photo_url = photo_url
         s.start()
 
         self.activity = 'awaiting_judgement'
         self.save()
+        history.record(self.game_id, 'submit', self, submission=str(s.id),
+                       mission=s.mission, judges=s.judges)
 
     @allower
     def submit_allowed(self, requestor, photo_url):
-        if requestor != self.player:
+        if requestor.id != self.player_id:
             raise NotAllowed('submit not allowed - player does not own char')
-        print 'ssact', self.activity
         if self.activity != 'hunting':
             raise NotAllowed('submit not allowed - not hunting')
 
 
 
-class Mission(models.Model, LazyJason):
+class Mission(LazyJasonModel):
     _created = CreationDateTimeField()
     game = models.ForeignKey(Game)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_active = models.BooleanField(default=False, db_index=True)
+    ix_hunter = models.IntegerField(null=True, db_index=True)
+    ix_prey = models.IntegerField(null=True, db_index=True)
+    ix_state = models.CharField(default='offered', max_length=16, db_index=True)
     _lazy_defaults = dict(
-        stunt = None,
-        hunter = None,
-        prey = None,
+        stunt = Lazy(ref='MissionStunt'),
+        hunter = Lazy(ref='Charactor'),
+        prey = Lazy(ref='Charactor'),
         award = 0,
         active = False,
+        # offered -> accepted, or offered -> expired
+        state = 'offered',
     )
+    _lazy_indexed = ('active', 'hunter', 'prey', 'state')
+
+    class Meta:
+        # Bounty.get_bounty_hunters: the active missions on a prey
+        index_together = [('game', 'ix_prey', 'ix_active')]
 
     def __unicode__(self):
         return "%s->%s (%s)" % (self.hunter, self.prey, self.stunt)
 
     def human_readable(self):
-        prey_obj = Charactor.objects.get(id=self.prey)
-        stunt_obj = MissionStunt.objects.get(id=self.stunt)
-        return "%s %s" % (prey_obj.name, stunt_obj.text)
+        return "%s %s" % (self.prey_Charactor__object.name, self.stunt_text)
+
+    @property
+    def stunt_text(self):
+        return stunts.text(self.stunt)
 
     def award_amounts(self):
         prey = self.prey_Charactor__object
-        additional = sum(b.coin for b in prey.current_bounties)
-        return (self.award, additional)
+        return (self.award, prey.open_bounty_coin)
 
     def accept(self):
         self.active = True
+        self.state = 'accepted'
         self.save()
 
+    def is_open_offer(self):
+        return self.state == 'offered' and younger_than_one_day_ago(self)
+
+    @classmethod
+    def expire(cls, offers):
+        for m in offers:
+            m.state = 'expired'
+        cls.bulk_save(offers)
+
+    @classmethod
+    def expire_stale_offers(cls, chunk_size=500):
+        '''
+        Expire offers more than a day old, chunk_size at a time.  Yields the
+        size of every chunk.
+        '''
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=1)
+        stale = cls.objects.filter(ix_state='offered', _created__lt=cutoff)
+        while True:
+            chunk = list(stale.order_by('id')[:chunk_size])
+            if not chunk:
+                return
+            with transaction.atomic():
+                cls.expire(chunk)
+            yield len(chunk)
+
+    @classmethod
+    def delete_expired_offers(cls, chunk_size=500):
+        '''
+        Delete expired offers chunk_size at a time.  Yields the size of
+        every chunk.
+        '''
+        expired = cls.objects.filter(ix_state='expired')
+        while True:
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return
+            cls.objects.filter(id__in=ids).delete()
+            yield len(ids)
+
     def complete(self):
         self.active = False
         self.save()
 
 
-class Bounty(models.Model, LazyJason):
+class Bounty(LazyJasonModel):
     game = models.ForeignKey(Game)
     target = models.ForeignKey(Charactor)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_claimed = models.BooleanField(default=False, db_index=True)
     _lazy_defaults = dict(
         claimed = False,
         coin = 0,
-        poster = None,
+        poster = Lazy(ref='Charactor'),
     )
+    _lazy_indexed = ('claimed',)
 
     @classmethod
     def get_bounty_hunters(cls, target):
-        bounty_hunters = set()
-        for m in [x for x in Mission.objects.all() if x.active]:
-            if m.prey_Charactor__object == target:
-                bounty_hunters.add(m.hunter_Charactor__object)
-        return bounty_hunters
+        missions = Mission.objects.filter(
+            game=target.game_id, ix_active=True, ix_prey=target.id,
+        )
+        hunters = Charactor.objects.filter(
+            id__in=missions.values('ix_hunter'))
+        return set(identitymap.get(Charactor, c.pk) or identitymap.add(c)
+                   for c in hunters)
 
     @classmethod
     def notify_claimed(cls, claimed_bounties):
         assert len(set(b.target for b in claimed_bounties)) == 1
         target = claimed_bounties[0].target
-        for hunter in cls.get_bounty_hunters(target):
-            hunter.notify_bounty_claimed()
+        Notification.fan_out(cls.get_bounty_hunters(target),
+                             'bounty_claimed', BOUNTY_CLAIMED)
 
     def notify_new(self):
-        for hunter in self.get_bounty_hunters(self.target):
-            hunter.notify_bounty_new(self)
+        Notification.fan_out(self.get_bounty_hunters(self.target),
+                             'bounty_new', BOUNTY_NEW, self)
 
     def __unicode__(self):
         return "%s->%s (%s)" % (self.poster, self.target, self.coin)
 
     def claim(self):
-        self.claimed = True
-        self.save()
+        '''
+        Returns False if the bounty had already been claimed
+        '''
+        with transaction.atomic():
+            if not Bounty.objects.filter(
+                    pk=self.pk, ix_claimed=False).update(ix_claimed=True):
+                return False
+            self.claimed = True
+            self.save()
+            Charactor.add_to_columns(
+                self.target_id, open_bounty_count=-1,
+                open_bounty_coin=-self.coin)
+        return True
 
 
     # API ----------------------------------------------
@@ -475,26 +953,33 @@ class Bounty(models.Model, LazyJason):
     @classmethod
     def new_bounty(cls, requestor, poster, target, amount):
         cls.new_bounty_allowed(requestor, poster, target, amount)
-        b = cls(game=poster.game, target=target)
-        b.poster = poster
-        b.coin = amount
-        b.save()
-        poster.remove_coin(amount)
+        with transaction.atomic():
+            b = cls(game=poster.game, target=target)
+            b.poster = poster
+            b.coin = amount
+            b.save()
+            Charactor.add_to_columns(
+                target.id, instance=target, open_bounty_count=1,
+                open_bounty_coin=amount)
+            poster.remove_coin(amount, 'bounty_posted', b)
+            b.notify_new()
+            history.record(b.game_id, 'bounty', poster, bounty=str(b.id),
+                           target=str(target.id), coin=amount)
         return b
 
     @classmethod
     @allower
     def new_bounty_allowed(cls, requestor, poster, target, amount):
-        if requestor != poster.player:
+        if requestor.id != poster.player_id:
             raise NotAllowed('not allowed - player does not own char')
         if poster.coin < amount:
             raise NotAllowed('not allowed - char does not have the coin')
 
         s = poster.submission
-        peeps = s.stakeholders
-
         if (not s or s.judgement is None):
             raise NotAllowed('not allowed - no submission ready')
+        peeps = s.stakeholders
+
         if (poster not in
             [peeps['hunter'], peeps['prey']]):
             raise NotAllowed('not allowed - must be hunter or prey')
@@ -511,28 +996,176 @@ class Bounty(models.Model, LazyJason):
 
 
 
-class Award(models.Model, LazyJason):
+class Award(LazyJasonModel):
     game = models.ForeignKey(Game)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
-    _lazy_defaults = {'coin':0, 'target':None}
+    _lazy_defaults = {'coin':0, 'target':Lazy(ref='Charactor')}
+
+
+class CoinTransaction(models.Model):
+    '''
+    Append-only record of every change to a Charactor's coin.  The
+    Charactor.coin column is the running balance, changed in SQL in the
+    same transaction as the row is added.
+    '''
+    _created = CreationDateTimeField()
+    charactor = models.ForeignKey(Charactor)
+    amount = models.IntegerField()
+    reason = models.CharField(max_length=64)
+    # What the coin was for, eg. 'Submission', 12
+    related_type = models.CharField(max_length=64, blank=True)
+    related_id = models.IntegerField(null=True)
+
+    def __unicode__(self):
+        return "%s %+d (%s)" % (self.charactor_id, self.amount, self.reason)
+
+    @classmethod
+    def record(cls, charactor, amount, reason, related=None, overdraw=True):
+        '''
+        Returns False, and changes nothing, if overdraw is False and the
+        balance would go below zero.
+        '''
+        if not amount:
+            return True
+        condition = None
+        if amount < 0 and not overdraw:
+            condition = dict(coin__gte=-amount)
+        with transaction.atomic():
+            if not Charactor.add_to_columns(
+                    charactor.pk, instance=charactor, condition=condition,
+                    coin=amount):
+                return False
+            cls.build(charactor, amount, reason, related).save()
+        return True
+
+    @classmethod
+    def record_many(cls, amounts, reason, related=None):
+        '''
+        record() for a list of (charactor, amount) at once, with one INSERT
+        for the rows and one UPDATE for the balances.  Never refuses.
+        '''
+        amounts = [(c, n) for c, n in amounts if n]
+        if not amounts:
+            return
+        pks = [c.pk for c, _ in amounts]
+        with transaction.atomic():
+            Charactor.objects.filter(pk__in=pks).update(
+                coin=models.F('coin') + models.Case(*[
+                    models.When(pk=c.pk, then=models.Value(n))
+                    for c, n in amounts
+                ], output_field=models.IntegerField()))
+            cls.objects.bulk_create([
+                cls.build(c, n, reason, related) for c, n in amounts])
+            balances = dict(
+                Charactor.objects.filter(pk__in=pks).values_list('id', 'coin'))
+        for c, _ in amounts:
+            c.coin = balances[c.pk]
+
+    @classmethod
+    def build(cls, charactor, amount, reason, related=None):
+        return cls(
+            charactor_id=charactor.pk,
+            amount=amount,
+            reason=reason,
+            related_type=type(related).__name__ if related else '',
+            related_id=related.pk if related else None,
+        )
 
 
-class Submission(models.Model, LazyJason):
+class Notification(models.Model):
+    '''
+    One message to one Charactor.  Charactor.notification_cursor is the id
+    of the last one they have read, so the unread ones are a range scan on
+    (charactor, id) however many they have had.
+    '''
+    _created = CreationDateTimeField()
+    charactor = models.ForeignKey(Charactor)
+    kind = models.CharField(max_length=32)
+    text = models.CharField(max_length=256, blank=True)
+    # What it is about, eg. 'Submission', 12
+    related_type = models.CharField(max_length=64, blank=True)
+    related_id = models.IntegerField(null=True)
+
+    class Meta:
+        index_together = [('charactor', 'id')]
+
+    def __unicode__(self):
+        return "%s %s: %s" % (self.charactor_id, self.kind, self.text)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            kind=self.kind,
+            text=self.text,
+            related_type=self.related_type,
+            related_id=self.related_id,
+            created=self._created.isoformat(),
+        )
+
+    @classmethod
+    def build(cls, charactor, kind, text='', related=None):
+        return cls(
+            charactor_id=charactor.pk,
+            kind=kind,
+            text=text,
+            related_type=type(related).__name__ if related else '',
+            related_id=related.pk if related else None,
+        )
+
+    @classmethod
+    def fan_out(cls, charactors, kind, text='', related=None):
+        '''
+        The same notification to many Charactors, in one INSERT
+        '''
+        cls.objects.bulk_create([
+            cls.build(c, kind, text, related) for c in charactors])
+
+    @classmethod
+    def unread(cls, charactor, after=None, limit=20):
+        '''
+        A page of notifications after the read cursor, or after the id
+        given, oldest first
+        '''
+        if after is None:
+            after = charactor.notification_cursor
+        return list(cls.objects.filter(
+            charactor=charactor.pk, id__gt=after,
+        ).order_by('id')[:limit])
+
+
+class Submission(LazyJasonModel):
     # This is the pic
     game = models.ForeignKey(Game)
-    db_attrs = models.CharField(default='{}', max_length=100*1024)
+    ix_dismissed = models.BooleanField(default=False, db_index=True)
+    ix_hunter = models.IntegerField(null=True, db_index=True)
+    ix_judgement = models.NullBooleanField(db_index=True)
     _lazy_defaults = dict(
-        mission = None,
+        mission = Lazy(ref='Mission'),
+        hunter = Lazy(ref='Charactor'),
         photo_url = '',
         tips = {'yes':0, 'no':0},
-        judges = [],
-        winning_judge = None,
+        judges = Lazy([], ref='Charactor'),
+        winning_judge = Lazy(ref='Charactor'),
         judgement = None,
         dismissed = False,
-        eligible_bounties = [],
+        eligible_bounties = Lazy([], ref='Bounty'),
+        started_at = None,  # time.time() when it went out to the judges
     )
+    _lazy_indexed = ('dismissed', 'hunter', 'judgement')
     base_pay = {'yes': 0, 'no': 25}
 
+    class Meta:
+        # judging_queue
+        index_together = [('game', 'ix_judgement', 'ix_dismissed')]
+
+    @classmethod
+    def judging_queue(cls, game_id):
+        '''
+        The game's submissions still waiting for a judgement, oldest first
+        '''
+        return cls.objects.filter(
+            game=game_id, ix_judgement__isnull=True, ix_dismissed=False,
+        ).order_by('id').prefetch_lazy('mission_Mission')
+
     def __unicode__(self):
         return "%s %s (Mission %s)" % (self.id, self.judgement, self.mission)
 
@@ -568,55 +1201,78 @@ class Submission(models.Model, LazyJason):
         return self._hunter_pay
 
     def start(self):
-        bounties = self.stakeholders['prey'].current_bounties
+        prey = self.stakeholders['prey']
+        bounties = prey.current_bounties if prey.open_bounty_count else []
         self.eligible_bounties = [str(b.id) for b in bounties]
         self.choose_judges()
+        self.started_at = time.time()
         self.save()
         self.notify_players_start()
 
+    @transaction.atomic
     def finish(self, winning_judge_obj, judgement):
         self.winning_judge = str(winning_judge_obj.id)
         self.judgement = judgement
         self.save()
-
+        if self.started_at is not None:
+            # The judges who never answered took at least this long too,
+            # else they'd keep looking like the fastest
+            judges = set(int(j) for j in self.judges)
+            judges.add(winning_judge_obj.id)
+            judging.record_latency(judges, time.time() - self.started_at)
+
+        claimed_bounties = []
         if judgement == True:
-            winning_judge_obj.add_coin(self.pay_yes)
+            winning_judge_obj.add_coin(self.pay_yes, 'judge_pay', self)
             self.mission_Mission__object.complete()
-            claimed_bounties = []
             for b in self.eligible_bounties_Bounty__objects:
-                if not b.claimed:
-                    b.claim()
+                if not b.claimed and b.claim():
                     claimed_bounties.append(b)
-            Bounty.notify_claimed(claimed_bounties)
+            if claimed_bounties:
+                Bounty.notify_claimed(claimed_bounties)
             self._hunter_pay = (self.mission_Mission__object.award
                                 + sum([b.coin for b in claimed_bounties]))
         else:
-            winning_judge_obj.add_coin(self.pay_no)
+            winning_judge_obj.add_coin(self.pay_no, 'judge_pay', self)
 
         self.stakeholders['hunter'].submission_finished(self)
         self.notify_players_finish()
 
+        pay = {str(winning_judge_obj.id):
+               self.pay_yes if judgement else self.pay_no}
+        if judgement:
+            pay[self.hunter] = pay.get(self.hunter, 0) + self.hunter_pay
+        history.record(self.game_id, 'judge', winning_judge_obj,
+                       submission=str(self.id), judgement=judgement, pay=pay,
+                       bounties=[str(b.id) for b in claimed_bounties])
+
     def choose_judges(self):
-        # TODO: make this smarter
-        allcs = set(self.game.charactor_set.all())
         m = self.mission_Mission__object
-        allcs.remove(m.hunter_Charactor__object)
-        allcs.remove(m.prey_Charactor__object)
-        self.judges = [allcs.pop(), allcs.pop()]
+        self.judges = judging.JudgeScheduler(self.game_id).pick(
+            2, exclude=(int(m.hunter), int(m.prey)))
 
     def notify_players_start(self):
-        self.stakeholders['prey'].notify_as_prey(self)
-        for judge in self.judges_Charactor__objects:
+        prey = self.stakeholders['prey']
+        judges = self.judges_Charactor__objects
+        prey.notify_as_prey(self)
+        for judge in judges:
             judge.notify_as_judge(self)
+        Notification.objects.bulk_create(
+            [Notification.build(prey, 'as_prey', AS_PREY, self)]
+            + [Notification.build(j, 'as_judge', AS_JUDGE, self)
+               for j in judges])
 
     def notify_players_finish(self):
-        self.stakeholders['prey'].notify_prey_finished(self)
-        for judge in self.judges_Charactor__objects:
+        prey = self.stakeholders['prey']
+        judges = self.judges_Charactor__objects
+        prey.notify_prey_finished(self)
+        for judge in judges:
             judge.notify_judge_finished(self)
+        Notification.fan_out([prey] + judges, 'judged', JUDGED, self)
 
     def notify_players_tip_change(self):
-        for c in self.stakeholders.values():
-            c.notify_tip_change(self)
+        Notification.fan_out(self.stakeholders.values(), 'tip_change',
+                             TIP_CHANGE, self)
 
     # API ----------------------------------------------
 
@@ -626,20 +1282,24 @@ class Submission(models.Model, LazyJason):
 
     @allower
     def judge_allowed(self, requestor, charactor):
-        if requestor != charactor.player:
+        if requestor.id != charactor.player_id:
             raise NotAllowed('not allowed - player does not own char')
         if charactor not in self.judges_Charactor__objects:
             raise NotAllowed('not allowed - char is not a judge')
+        if self.judgement is not None:
+            raise NotAllowed('not allowed - already judged')
 
     def dismiss(self, requestor, charactor):
         self.dismiss_allowed(requestor, charactor)
         self.dismissed = True
         self.save()
         charactor.submission_dismissed(self)
+        history.record(self.game_id, 'dismiss', charactor,
+                       submission=str(self.id))
 
     @allower
     def dismiss_allowed(self, requestor, charactor):
-        if requestor != charactor.player:
+        if requestor.id != charactor.player_id:
             raise NotAllowed('not allowed - player does not own char')
         if self.judgement is None:
             raise NotAllowed('not allowed - submission has not been judged')
@@ -648,16 +1308,6 @@ class Submission(models.Model, LazyJason):
 
 
 
-for val in locals().values():
-    if hasattr(val, '__bases__'):
-        bases = val.__bases__
-        if models.Model in bases and LazyJason in bases:
-            post_init.connect(post_init_for_lazies, val)
-            pre_save.connect(pre_save_for_lazies, val)
-            post_save.connect(post_save_for_lazies, val)
-
-
-
 def scenario_1(delete=False):
     def O(cls, d1, d2):
         o = cls(**d1)
@@ -672,28 +1322,35 @@ def scenario_1(delete=False):
         obs = cls.objects.filter(**d1)
         [o.delete() for o in obs]
 
+    def G(cls, d1, d2):
+        # unique columns: reuse the row from last time
+        return cls.objects.filter(**d1).first() or O(cls, d1, d2)
+
     if delete:
-        O = D
+        O = G = D
 
-    p1 = O(Player, dict(unique_name='s1-Shandy'), dict(last_auth_token = '123'))
-    p2 = O(Player, dict(unique_name='s1-Luna'), dict(last_auth_token = '123'))
+    p1 = G(Player, dict(unique_name='s1-Shandy'), dict(last_auth_token = '123'))
+    p2 = G(Player, dict(unique_name='s1-Luna'), dict(last_auth_token = '123'))
     g = O(Game, dict(name='Sc1'), dict(creator=p1))
     c1 = O(Charactor, dict(game=g, player=p1), dict(
-            c_name='C-Shandy', coin=100))
+            c_name='C-Shandy'))
     c2 = O(Charactor, dict(game=g, player=p1), dict(
-            c_name='C-Jared', coin=100))
+            c_name='C-Jared'))
     c3 = O(Charactor, dict(game=g, player=p1), dict(
-            c_name='C-Alex', coin=100))
+            c_name='C-Alex'))
     c4 = O(Charactor, dict(game=g, player=p2), dict(
-            c_name='C-Luna', coin=100))
+            c_name='C-Luna'))
     c5 = O(Charactor, dict(game=g, player=p2), dict(
-            c_name='C-Kim', coin=100))
+            c_name='C-Kim'))
     c6 = O(Charactor, dict(game=g, player=p2), dict(
-            c_name='C-Kristy', coin=100))
+            c_name='C-Kristy'))
 
     if delete:
         return
 
+    # Through the ledger, so the balances add up to the CoinTransactions
+    CoinTransaction.record_many(
+        [(c, 100) for c in (c1, c2, c3, c4, c5, c6)], 'scenario')
     g.start(p1)
 
     m = c1.get_potential_missions(self_save=False)[0]
@@ -0,0 +1,62 @@
+# api.players
+
+'''
+Which Player a request comes from.  PlayerMiddleware calls for_request()
+once per request and puts the answer on request.player, for api.views and
+client.views alike.
+
+The Player's row is kept in Django's cache under its id, so a logged in
+request builds its Player from the cached row instead of querying.  The row
+is cached rather than the instance, so every request gets its own clean
+copy.  Player.save() and .delete() drop the entry; with a per-process cache
+(the default locmem one) other processes notice within PLAYER_CACHE_TTL
+seconds.
+'''
+
+from django.apps import apps
+from django.core.cache import cache
+
+from api import identitymap
+
+PLAYER_CACHE_TTL = 300
+
+
+def cache_key(player_id):
+    return 'api.players:%s' % player_id
+
+
+def get(player_id):
+    '''
+    The Player with this id, or None
+    '''
+    Player = apps.get_model('api', 'Player')
+    try:
+        player_id = int(player_id)
+    except (TypeError, ValueError):
+        return None
+    attnames = [f.attname for f in Player._meta.concrete_fields]
+    row = cache.get(cache_key(player_id))
+    if row is None:
+        rows = Player.objects.filter(pk=player_id).values_list(*attnames)[:1]
+        if not rows:
+            return None
+        row = rows[0]
+        cache.set(cache_key(player_id), row, PLAYER_CACHE_TTL)
+    return identitymap.add(Player.from_db('default', attnames, row))
+
+
+def invalidate(player_id):
+    cache.delete(cache_key(player_id))
+
+
+def for_request(request):
+    '''
+    The session's Player, else the one connected to the logged in
+    django User, else None
+    '''
+    player = get(request.session.get('player_id'))
+    if player is None:
+        user = getattr(request, 'user', None)
+        if user is not None and hasattr(user, 'playerconnector'):
+            player = user.playerconnector.player
+    return player
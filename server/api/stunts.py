@@ -0,0 +1,112 @@
+# api.stunts
+
+'''
+A process wide, in-memory catalog of every MissionStunt.  Generating and
+rendering missions only needs a stunt's id, text and weight, so they are
+served from here instead of querying the table every time.
+
+MissionStunt.save() and .delete() throw the catalog away in this process.
+Other processes notice changes within CATALOG_TTL seconds.
+
+Stunts are picked by weight with the alias method: O(n) to build the
+tables, O(1) per pick.
+'''
+
+import random
+import threading
+import time
+
+from django.apps import apps
+
+CATALOG_TTL = 300
+
+_lock = threading.Lock()
+_catalog = None
+
+
+class StuntCatalog(object):
+    def __init__(self, stunts):
+        self.built = time.time()
+        self.by_id = dict((s.id, s) for s in stunts)
+        weighted = [(s.id, float(s.weight)) for s in stunts if s.weight > 0]
+        self.ids = [sid for sid, _ in weighted]
+        self.prob, self.alias = build_alias([w for _, w in weighted])
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, stunt_id):
+        return self.by_id.get(int(stunt_id))
+
+    def text(self, stunt_id):
+        stunt = self.get(stunt_id)
+        return stunt.text if stunt is not None else ''
+
+    def sample(self, rand=random.random):
+        '''
+        A MissionStunt, chosen by weight
+        '''
+        if not self.ids:
+            raise LookupError('No MissionStunt has a weight above 0')
+        u = rand() * len(self.ids)
+        i = int(u)
+        if u - i >= self.prob[i]:
+            i = self.alias[i]
+        return self.by_id[self.ids[i]]
+
+
+def build_alias(weights):
+    '''
+    Vose's alias tables: column i is picked with probability prob[i],
+    otherwise alias[i].
+    '''
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = range(n)
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # Whatever is left is 1.0 give or take rounding
+    return prob, alias
+
+
+def catalog():
+    global _catalog
+    current = _catalog
+    if current is not None and time.time() - current.built < CATALOG_TTL:
+        return current
+    with _lock:
+        if _catalog is current:
+            MissionStunt = apps.get_model('api', 'MissionStunt')
+            _catalog = StuntCatalog(list(MissionStunt.objects.all()))
+        return _catalog
+
+
+def invalidate():
+    global _catalog
+    _catalog = None
+
+
+def sample():
+    return catalog().sample()
+
+
+def get(stunt_id):
+    return catalog().get(stunt_id)
+
+
+def text(stunt_id):
+    if stunt_id is None:
+        return ''
+    return catalog().text(stunt_id)
@@ -4,6 +4,7 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^stats/?$', views.stats, name='stats'),
 
     url(r'^new_game/(?P<name>[^/]+)/?$',
         views.new_game , name='new game'),
@@ -11,11 +12,21 @@ urlpatterns = [
         views.game , name='game'),
     url(r'^game/(?P<game_id>[^/]+)/start/?$',
         views.game_start , name='game start'),
+    url(r'^game/(?P<game_id>[^/]+)/end/?$',
+        views.game_end , name='game end'),
     url(r'^game/(?P<game_id>[^/]+)/invite/?$',
         views.game_invite, name='game invite'),
+    url(r'^game/(?P<game_id>[^/]+)/history/?$',
+        views.game_history, name='game history'),
 
     url(r'^player/(?P<player_id>[^/]+)/?$',
         views.player, name='player'),
+    url(r'^invites/?$',
+        views.player_invites, name='player invites'),
+    url(r'^invite/(?P<invite_id>[^/]+)/accept/?$',
+        views.invite_accept, name='invite accept'),
+    url(r'^invite/(?P<invite_id>[^/]+)/decline/?$',
+        views.invite_decline, name='invite decline'),
 
     url(r'^charactor/(?P<charactor_id>[^/]+)/?$',
         views.charactor, name='charactor'),
@@ -23,6 +34,13 @@ urlpatterns = [
         views.charactor_accept, name='charactor accept'),
     url(r'^charactor/(?P<charactor_id>[^/]+)/submit/?$',
         views.charactor_submit, name='charactor submit'),
+    url(r'^charactor/(?P<charactor_id>[^/]+)/judge_next/?$',
+        views.charactor_judge_next, name='charactor judge next'),
+    url(r'^charactor/(?P<charactor_id>[^/]+)/notifications/?$',
+        views.charactor_notifications, name='charactor notifications'),
+    url(r'^charactor/(?P<charactor_id>[^/]+)/notifications/read/?$',
+        views.charactor_notifications_read,
+        name='charactor notifications read'),
 
     url(r'^submission/(?P<submission_id>[^/]+)/judgement/?$',
         views.submission_judgement, name='submission judgement'),
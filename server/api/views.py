@@ -15,13 +15,14 @@ class Http400(APIException):
     status_code = HTTP_400_BAD_REQUEST
 
 from api.models import *
+from api import instrument
+from api.instrument import trace, INFO
 
 def kwargs_from_json(jdata):
     try:
-        print 'Trying to loads the jdata', jdata
         json_data = json.loads(jdata)
     except Exception as e:
-        print 'JSON PARSE FAIL', e
+        trace(INFO, 'JSON PARSE FAIL %s: %r', e, jdata)
         raise forms.ValidationError("Invalid JSON data in %s" % jdata)
     assert type(json_data) == dict
     return json_data
@@ -29,13 +30,18 @@ def kwargs_from_json(jdata):
 class ArgNotFound(Exception):
     pass
 
+def json_list(val):
+    # list() would happily turn "ab" into ['a', 'b']
+    if not isinstance(val, list):
+        raise Http400('expected a JSON list, got %r' % (val,))
+    return val
+
 def from_session(request, arg_name='player_id', *args, **kwargs):
     # TODO: this only does the player object now.  Might be all we ever need.
-    try:
-        val = request.session['player_id']
-    except KeyError:
+    # PlayerMiddleware has already looked it up.
+    if request.player is None:
         raise ArgNotFound('session - %s' % 'player_id')
-    return Player.objects.get(pk=val)
+    return request.player
 
 def from_path(request, arg_name, *args, **kwargs):
     if type(arg_name) == int:
@@ -47,19 +53,24 @@ def from_path(request, arg_name, *args, **kwargs):
     return val
 
 def from_json(request, arg_name, *args, **kwargs):
-    print request.POST
     json_keys = [k for k in request.POST.keys()
                  if k.endswith('_json')]
     assert len(json_keys) == 1
     json_key = json_keys[0]
     jdict = kwargs_from_json(request.POST[json_key])
-    print 'Key', arg_name
     try:
         val = jdict[arg_name]
     except KeyError:
         raise ArgNotFound('json %s' % arg_name)
     return val
 
+def from_query(request, arg_name, *args, **kwargs):
+    try:
+        val = request.GET[arg_name]
+    except KeyError:
+        raise ArgNotFound('query %s' % arg_name)
+    return val
+
 
 class Make(object):
     FAIL = object() # A sentinel
@@ -70,6 +81,7 @@ class Make(object):
         charactor = Charactor,
         mission = Mission,
         submission = Submission,
+        invite = Invite,
     )
 
     @staticmethod
@@ -81,7 +93,7 @@ class Make(object):
                 val = from_fn(request, argname, *fn_args, **fn_kwargs)
                 val = literal_type(val)
             except ArgNotFound:
-                if otherwise == FAIL:
+                if otherwise is Make.FAIL:
                     raise
                 val = otherwise
             return val
@@ -98,7 +110,7 @@ class Make(object):
                 val = from_fn(request, argname, *fn_args, **fn_kwargs)
                 obj = get_object_or_404(obj_class, pk=int(val))
             except ArgNotFound:
-                if otherwise == FAIL:
+                if otherwise is Make.FAIL:
                     raise
                 obj = otherwise
             return obj
@@ -111,15 +123,19 @@ class Make(object):
 
     @staticmethod
     def a_str(from_fn, field_name=None, otherwise=FAIL):
-        return Make.literal_wrapper(from_fn, field_name, str)
+        return Make.literal_wrapper(from_fn, field_name, str, otherwise)
 
     @staticmethod
     def a_bool(from_fn, field_name=None, otherwise=FAIL):
-        return Make.literal_wrapper(from_fn, field_name, bool)
+        return Make.literal_wrapper(from_fn, field_name, bool, otherwise)
+
+    @staticmethod
+    def a_list(from_fn, field_name=None, otherwise=FAIL):
+        return Make.literal_wrapper(from_fn, field_name, json_list, otherwise)
 
     @staticmethod
     def a__Charactor(from_fn, field_name=None, otherwise=FAIL):
-        return Make.class_wrapper(from_fn, field_name, Charactor)
+        return Make.class_wrapper(from_fn, field_name, Charactor, otherwise)
 
     @classmethod
     def an_obj(cls, from_fn, field_name=None, otherwise=FAIL):
@@ -128,14 +144,12 @@ class Make(object):
                 argname = field_name
             else:
                 argname += '_id'
-            print 'Making ', argname
             id_val = from_fn(request, argname, *fn_args, **fn_kwargs)
             if argname.endswith('_id'):
                 cls_name = argname[:-3]
             else:
                 cls_name = argname
             obj_class = cls.class_mapper[cls_name]
-            print 'Obj class:', obj_class
             obj = get_object_or_404(obj_class, pk=int(id_val))
             return obj
         return an_obj_wrapper
@@ -149,16 +163,18 @@ class Make(object):
 
         @wraps(fn)
         def wrapper(request, *w_args, **w_kwargs):
-            #print 'fn-args', w_args
-            #print 'w_kwargs', w_kwargs
             fn_kwargs = {}
-            for i, argname in enumerate(fn_kwargs_names):
-                val_maker = argspec.defaults[i]
-                print argname, val_maker
-                fn_kwargs[argname] = val_maker(request, argname,
-                                               *w_args, **w_kwargs)
-
-            ret_dict = fn(request, **fn_kwargs)
+            try:
+                for i, argname in enumerate(fn_kwargs_names):
+                    val_maker = argspec.defaults[i]
+                    fn_kwargs[argname] = val_maker(request, argname,
+                                                   *w_args, **w_kwargs)
+
+                ret_dict = fn(request, **fn_kwargs)
+            except Http400 as e:
+                # these are plain django views, DRF isn't there to catch it
+                return JsonResponse(dict(error=e.detail),
+                                    status=e.status_code)
             return JsonResponse(ret_dict)
         return wrapper
 
@@ -174,6 +190,15 @@ def index(request):
     s += '\n<hr>Your session: "%s"' % request.session.items()
     return HttpResponse(s)
 
+def stats(request):
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse(dict(
+        level=instrument.level,
+        totals=instrument.as_dict(instrument.totals),
+        request=instrument.as_dict(instrument.request_counts()),
+    ))
+
 def player(request, player_id):
     return HttpResponse('player ID %s' % player_id)
 
@@ -208,16 +233,55 @@ def game_start(
     return g.to_dict()
 
 
+@Make.args
+def game_end(
+    request,
+    p = from_session,
+    g = Make.an_obj(from_path, 'game_id'),
+):
+    g.end(p)
+    return g.to_dict()
+
+
+@Make.args
+def game_history(
+    request,
+    p = from_session,
+    g = Make.an_obj(from_path, 'game_id'),
+    upto = Make.an_int(from_query, otherwise=None),
+):
+    return g.history(p, upto)
+
+
 @Make.args
 def game_invite(
     request,
     p = from_session,
     g = Make.an_obj(from_path, 'game_id'),
-    unique_id = Make.a_str(from_json),
+    unique_id = Make.a_str(from_json, otherwise=None),
     name = Make.a_str(from_json, otherwise=''),
+    invitees = Make.a_list(from_json, otherwise=None),
 ):
-    g.invite(p, unique_id, name)
-    return g.to_dict()
+    # One unique_id/name, or a list of invitees, each a unique_id or a
+    # {"unique_id": ..., "name": ...}
+    if invitees is None:
+        if unique_id is None:
+            raise Http400('unique_id or invitees required')
+        invitees = [dict(unique_id=unique_id, name=name)]
+    pairs = []
+    for i in invitees:
+        if isinstance(i, dict):
+            i_id, i_name = i.get('unique_id'), i.get('name', '')
+        else:
+            i_id, i_name = i, ''
+        if (not isinstance(i_id, basestring) or not i_id
+            or not isinstance(i_name, basestring)):
+            raise Http400('invitees must be unique_id strings: %r' % (i,))
+        pairs.append((i_id, i_name))
+    invited = g.invite_many(p, pairs)
+    d = g.to_dict()
+    d['invited'] = [pl.id for pl in invited]
+    return d
 
 
 @Make.args
@@ -227,7 +291,6 @@ def charactor_accept(
     c = Make.a__Charactor(from_path, 'charactor_id'),
     m = Make.an_obj(from_json, 'mission_id'),
 ):
-    print 'accept_mission', p, m
     c.accept_mission(p, m)
     return {'success':True}
 
@@ -243,6 +306,81 @@ def charactor_submit(
     return {'success':True, 'submission':c.submission.id}
 
 
+@Make.args
+def charactor_judge_next(
+    request,
+    p = from_session,
+    c = Make.a__Charactor(from_path, 'charactor_id'),
+):
+    s = c.take_judging(p)
+    return {'success':True, 'submission':s.id if s else None}
+
+
+@Make.args
+def charactor_notifications(
+    request,
+    p = from_session,
+    c = Make.a__Charactor(from_path, 'charactor_id'),
+    after = Make.an_int(from_query, otherwise=None),
+    limit = Make.an_int(from_query, otherwise=20),
+):
+    limit = max(1, min(limit, 100))
+    notes = c.unread_notifications(p, after, limit)
+    return {
+        'notifications': [n.to_dict() for n in notes],
+        'cursor': c.notification_cursor,
+        # Pass as ?after= for the next page
+        'next': notes[-1].id if len(notes) == limit else None,
+    }
+
+
+@Make.args
+def charactor_notifications_read(
+    request,
+    p = from_session,
+    c = Make.a__Charactor(from_path, 'charactor_id'),
+    upto = Make.an_int(from_json),
+):
+    c.read_notifications(p, upto)
+    return {'success':True, 'cursor':c.notification_cursor}
+
+
+@Make.args
+def player_invites(
+    request,
+    p = from_session,
+    after = Make.an_int(from_query, otherwise=None),
+    limit = Make.an_int(from_query, otherwise=20),
+):
+    limit = max(1, min(limit, 100))
+    invites = Invite.pending_for(p, after, limit)
+    return {
+        'invites': [i.to_dict() for i in invites],
+        # Pass as ?after= for the next page
+        'next': invites[-1].id if len(invites) == limit else None,
+    }
+
+
+@Make.args
+def invite_accept(
+    request,
+    p = from_session,
+    invite = Make.an_obj(from_path),
+):
+    c = invite.accept(p)
+    return {'success':True, 'charactor':c.id if c else None}
+
+
+@Make.args
+def invite_decline(
+    request,
+    p = from_session,
+    invite = Make.an_obj(from_path),
+):
+    invite.decline(p)
+    return {'success':True}
+
+
 @Make.args
 def submission_judgement(
     request,
@@ -13,25 +13,15 @@ from mako.lookup import TemplateLookup
 
 mplates = TemplateLookup(directories=['client/templates/client'])
 
+INVITES_PER_PAGE = 20
+
 from api.models import *
 
 def index(request):
-    print Game
-    print '----'
-    print get_object_or_404(Game, pk=1)
-    print '----'
     g = get_object_or_404(Game, pk=1)
-    p = None
-
-    session_pid = request.session.get('player_id')
-    if session_pid:
-        p = Player.objects.get(pk=session_pid)
-    if not p and hasattr(request.user, 'playerconnector'):
-        p = request.user.playerconnector.player
-
     return render(request, 'client/index.html', {
         'g': g,
-        'p': p,
+        'p': request.player,
     })
 
 def authorize(request, player_id, token):
@@ -43,20 +33,31 @@ def authorize(request, player_id, token):
         request.session['player_id'] = None
         return HttpResponse('Wrong auth')
 
+def request_player(request):
+    if request.player is None:
+        raise Http404('Not logged in')
+    return request.player
+
 def player(request, player_id):
-    session_pid = request.session.get('player_id')
-    p = get_object_or_404(Player, pk=session_pid)
+    p = request_player(request)
+    try:
+        after = int(request.GET['after'])
+    except (KeyError, ValueError):
+        after = None
+    invites = Invite.pending_for(p, after, INVITES_PER_PAGE)
     return render(request, 'client/player.html', {
         'p': p,
+        'invites': invites,
+        'next_invites': (invites[-1].id if len(invites) == INVITES_PER_PAGE
+                         else None),
     })
 
 def charactor(request, charactor_id):
-    session_pid = request.session.get('player_id')
-    p = get_object_or_404(Player, pk=session_pid)
+    p = request_player(request)
     results = [c for c in p.charactor_set.all()
                if c.id == int(charactor_id)]
     if not results:
-        raise Http404("Charactor not found in Player %s's list" % session_pid)
+        raise Http404("Charactor not found in Player %s's list" % p.id)
     c = results[0]
     return makoify(request, 'charactor',
         c=c,
@@ -66,12 +67,11 @@ def charactor(request, charactor_id):
     )
 
 def charactor_submission(request, charactor_id, submission_id):
-    session_pid = request.session.get('player_id')
-    p = get_object_or_404(Player, pk=session_pid)
+    p = request_player(request)
     results = [c for c in p.charactor_set.all()
                if c.id == int(charactor_id)]
     if not results:
-        raise Http404("Charactor not found in Player %s's list" % session_pid)
+        raise Http404("Charactor not found in Player %s's list" % p.id)
     c = results[0]
     s = get_object_or_404(Submission, pk=submission_id)
 
@@ -5,6 +5,7 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 
 from api.models import *
+from api import players
 
 class PlayerConnector(models.Model):
     user = models.OneToOneField(User)
@@ -12,16 +13,14 @@ class PlayerConnector(models.Model):
 
     @property
     def player(self):
-        try:
-            return Player.objects.get(pk=self.player_id)
-        except (ValueError, DoesNotExist):
-            return None
+        return players.get(self.player_id)
 
 def on_create(**kwargs):
     if kwargs.get('created') != True:
         return
     newu = kwargs.get('instance')
-    newp = Player(unique_name=newu.username)
+    # They may have been invited before they signed up
+    newp, _ = Player.objects.get_or_create(unique_name=newu.username)
     newp.make_token() # this does the save()
     newpc = PlayerConnector(user=newu, player_id=newp.id)
     newpc.save()
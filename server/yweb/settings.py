@@ -53,6 +53,9 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.IdentityMapMiddleware',
+    'api.middleware.PlayerMiddleware',
+    'api.middleware.InstrumentMiddleware',
 )
 
 ROOT_URLCONF = 'yweb.urls'
@@ -113,3 +116,16 @@ USE_TZ = False
 
 STATIC_URL = '/static/'
 
+
+
+# LazyJason
+# How db_attrs is stored for models that don't set _lazy_codec.  One of
+# 'json', 'fastjson' or 'zlib', see api/jasoncodec.py
+
+LAZYJASON_CODEC = 'json'
+
+# Starting level for api.instrument tracing.  5 (TRACE) logs every lazy
+# attribute write, 20 (INFO) logs NotAllowed raises and per-request counters.
+# Change it at runtime with api.instrument.set_level().
+
+LAZYJASON_TRACE_LEVEL = 30